@@ -59,8 +59,7 @@ class AccumulationCache:
         if start < n:
             if end > n:
                 end = n
-            for i in range(start, end):
-                self._dirty.insert(-i, i)
+            self._dirty.insert_many([ (-i, i) for i in range(start, end) ])
 
     def truncate(self, i):
         if i < len(self._partial_sums):
@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Derrick Moser <derrick_moser@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+# headless comparisons driven from the command line, nothing here may import
+# gi so this works without a display
+
+import array, concurrent.futures, json, os, sys, time
+
+import diffuse.diffcache, diffuse.dircompare, diffuse.filecompare, diffuse.reader
+
+FORMATS = ('unified', 'json', 'stats')
+
+# exit codes follow diff(1)
+SAME, DIFFERENT, TROUBLE = range(3)
+
+# load and align the files named by 'specs', a list of (name, encodings,
+# label) tuples as built by the command line parser, alignments are reused
+# from 'cache_dir' if it is not None, returns the FileCompare and whether
+# any diff made while loading the files had to be approximated
+def compare(specs, cache_dir=None):
+    fc = diffuse.filecompare.FileCompare(max(len(specs), 2))
+    if cache_dir is not None:
+        fc.set_diff_cache(diffuse.diffcache.DiffCache(cache_dir))
+    approximate = False
+    for p, (name, encodings, label) in enumerate(specs):
+        fc.load_file(p, name, encodings)
+        approximate = approximate or fc.is_approximate()
+    return fc, approximate
+
+# aligned rows as tuples of strings with None for spacers, a row matches if
+# every pane has the same line
+def get_rows(fc):
+    return zip(*[ fc.get_strings(p) for p in range(fc.n_panes()) ])
+
+def _is_match(row):
+    s = row[0]
+    if s is None:
+        return False
+    for t in row:
+        if t != s:
+            return False
+    return True
+
+# runs of matching and differing rows as (match, i0, i1) tuples along with
+# the rows and the number of lines before each row in each pane
+def get_runs(fc):
+    rows, runs = [], []
+    starts = [ array.array('q', [ 0 ]) for p in range(fc.n_panes()) ]
+    pairing = [ (a, a.append) for a in starts ]
+    i0, prev = 0, None
+    for i, row in enumerate(get_rows(fc)):
+        rows.append(row)
+        for s, (a, append) in zip(row, pairing):
+            append(a[-1] if s is None else a[-1] + 1)
+        m = _is_match(row)
+        if m is not prev:
+            if prev is not None:
+                runs.append((prev, i0, i))
+            i0, prev = i, m
+    if prev is not None:
+        runs.append((prev, i0, len(rows)))
+    return rows, runs, starts
+
+# range in the style of a unified diff hunk header
+def _format_range(start, end):
+    n = end - start
+    if n == 1:
+        return '%d' % (start + 1, )
+    if n == 0:
+        return '%d,0' % (start, )
+    return '%d,%d' % (start + 1, n)
+
+def _write_line(out, prefix, s):
+    out.write(prefix)
+    out.write(s)
+    if not s.endswith(('\n', '\r')):
+        out.write('\n\\ No newline at end of file\n')
+
+def write_unified(out, labels, rows, runs, starts, context=3):
+    if len(labels) != 2:
+        raise ValueError('unified diffs need exactly two files')
+    # group the differing runs into hunks with 'context' rows on each side
+    hunks = []
+    for match, i0, i1 in runs:
+        if match:
+            continue
+        i0, i1 = max(i0 - context, 0), min(i1 + context, len(rows))
+        if hunks and i0 <= hunks[-1][1]:
+            hunks[-1][1] = i1
+        else:
+            hunks.append([ i0, i1 ])
+    if not hunks:
+        return
+    out.write('--- %s\n+++ %s\n' % tuple(labels))
+    a, b = starts
+    for i0, i1 in hunks:
+        out.write('@@ -%s +%s @@\n' % (_format_range(a[i0], a[i1]), _format_range(b[i0], b[i1])))
+        i = i0
+        while i < i1:
+            if _is_match(rows[i]):
+                _write_line(out, ' ', rows[i][0])
+                i += 1
+                continue
+            # removed lines come before the lines added in their place
+            j = i
+            while j < i1 and not _is_match(rows[j]):
+                j += 1
+            for row in rows[i:j]:
+                if row[0] is not None:
+                    _write_line(out, '-', row[0])
+            for row in rows[i:j]:
+                if row[1] is not None:
+                    _write_line(out, '+', row[1])
+            i = j
+
+def get_json(fc, labels, runs, starts, approximate=False):
+    files = []
+    for p, label in enumerate(labels):
+        f = fc.get_file(p)
+        files.append({ 'name': label, 'encoding': f.get_encoding(), 'lines': starts[p][-1] })
+    blocks = []
+    for match, i0, i1 in runs:
+        blocks.append({ 'match': match, 'rows': [ i0, i1 ], 'lines': [ [ a[i0], a[i1] ] for a in starts ] })
+    return { 'files': files, 'rows': fc.get_n_lines(), 'approximate': approximate, 'blocks': blocks }
+
+# summary of a comparison as a single line
+def get_stats(labels, rows, runs, starts, approximate=False):
+    matched, differences, changed = 0, 0, [ 0 for label in labels ]
+    for match, i0, i1 in runs:
+        if match:
+            matched += i1 - i0
+        else:
+            differences += 1
+            for p, a in enumerate(starts):
+                changed[p] += a[i1] - a[i0]
+    s = '%s: %d rows, %d matched, %d differences, %s lines changed' % (' '.join(labels), len(rows), matched, differences, '/'.join([ str(n) for n in changed ]))
+    if approximate:
+        s += ' (approximate)'
+    return s
+
+def _is_identical(names):
+    sizes = [ os.stat(name).st_size for name in names ]
+    if any(size != sizes[0] for size in sizes):
+        return False
+    digests = [ diffuse.reader.digest(name) for name in names ]
+    return all(d == digests[0] for d in digests)
+
+# compare one manifest entry, this runs in a worker process so it takes and
+# returns only plain data
+def compare_entry(entry):
+    idx, names, encodings, cache_dir = entry
+    result, start = { 'index': idx, 'files': names }, time.perf_counter()
+    try:
+        if _is_identical(names):
+            result.update(status=SAME, identical=True, blocks=0, approximate=False)
+        else:
+            fc, approximate = compare([ (name, encodings, None) for name in names ], cache_dir)
+            rows, runs, starts = get_runs(fc)
+            blocks = [ (i0, i1) for match, i0, i1 in runs if not match ]
+            result.update(status=DIFFERENT if blocks else SAME, identical=False, rows=len(rows), blocks=len(blocks), changed=[ sum([ a[i1] - a[i0] for i0, i1 in blocks ]) for a in starts ], approximate=approximate)
+    except (OSError, UnicodeDecodeError) as e:
+        result.update(status=TROUBLE, error=str(e))
+    except Exception as e:
+        # any other failure is reported with its entry so the rest of the
+        # manifest is still compared
+        result.update(status=TROUBLE, error='%s: %s' % (type(e).__name__, e))
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+# entries of a manifest with the tab separated names of two or three files
+# on each line, blank lines and lines starting with '#' are skipped
+def read_manifest(f, encodings):
+    for line in f:
+        line = line.rstrip('\r\n')
+        if not line or line.startswith('#'):
+            continue
+        names = line.split('\t')
+        if not 2 <= len(names) <= 3:
+            raise ValueError('manifest entries need two or three files: %s' % (repr(line), ))
+        yield names, encodings
+
+# compare every entry of a manifest in a pool of 'jobs' processes and write
+# the results as JSON lines in manifest order, returns the exit code
+def run_manifest(out, entries, jobs=None, cache_dir=None):
+    entries = [ (idx, names, encodings, cache_dir) for idx, (names, encodings) in enumerate(entries) ]
+    if jobs == 1:
+        results = map(compare_entry, entries)
+        executor = None
+    else:
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        executor = concurrent.futures.ProcessPoolExecutor(jobs)
+        # batch small comparisons to limit the cost of talking to workers
+        results = executor.map(compare_entry, entries, chunksize=max(min(len(entries) // (8 * jobs), 64), 1))
+    status = SAME
+    try:
+        for result in results:
+            status = max(status, result['status'])
+            json.dump(result, out)
+            out.write('\n')
+            out.flush()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return status
+
+def _write_results(out, fmt, fc, approximate, labels, context):
+    rows, runs, starts = get_runs(fc)
+    if fmt == 'unified':
+        write_unified(out, labels, rows, runs, starts, context)
+    elif fmt == 'json':
+        json.dump(get_json(fc, labels, runs, starts, approximate), out)
+        out.write('\n')
+    else:
+        out.write(get_stats(labels, rows, runs, starts, approximate))
+        out.write('\n')
+    for match, i0, i1 in runs:
+        if not match:
+            return DIFFERENT
+    return SAME
+
+# compare directory trees, only changed files are loaded and only when
+# their contents are written
+def _run_dirs(out, fmt, specs, context, trust_mtime):
+    labels = [ name if label is None else label for name, encodings, label in specs ]
+    dc = diffuse.dircompare.DirCompare([ name for name, encodings, label in specs ], specs[0][1], trust_mtime)
+    dc.scan()
+    entries = dc.get_entries()
+    if fmt == 'json':
+        json.dump({ 'roots': labels, 'entries': [ { 'path': path, 'state': diffuse.dircompare.STATE_NAMES[state] } for path, state in entries ] }, out)
+        out.write('\n')
+    elif fmt == 'stats':
+        counts = [ 0 for name in diffuse.dircompare.STATE_NAMES ]
+        for path, state in entries:
+            counts[state] += 1
+        out.write('%s: %s\n' % (' '.join(labels), ', '.join([ '%d %s' % (n, name) for n, name in zip(counts, diffuse.dircompare.STATE_NAMES) ])))
+    else:
+        reported = set()
+        for i, (path, state) in enumerate(entries):
+            if state == diffuse.dircompare.SAME:
+                continue
+            names = dc.get_names(path)
+            if state == diffuse.dircompare.CHANGED:
+                file_labels = [ os.path.join(label, path) for label in labels ]
+                try:
+                    _write_results(out, fmt, dc.get_file_compare(i), dc.is_approximate(i), file_labels, context)
+                except UnicodeDecodeError:
+                    out.write('Files %s and %s differ\n' % tuple(file_labels))
+            else:
+                # like diff -r, report the topmost missing directory once
+                parts = path.split('/')
+                for k in range(1, len(parts) + 1):
+                    if not any(name is None and os.path.exists(os.path.join(root, *parts[:k])) for root, name in zip(dc.get_roots(), names)):
+                        break
+                top = '/'.join(parts[:k])
+                if top in reported:
+                    continue
+                reported.add(top)
+                for label, name in zip(labels, names):
+                    if name is not None:
+                        out.write('Only in %s: %s\n' % (os.path.join(label, *parts[:k - 1]), parts[k - 1]))
+    for path, state in entries:
+        if state != diffuse.dircompare.SAME:
+            return DIFFERENT
+    return SAME
+
+def _run(out, fmt, specs, context, trust_mtime, cache_dir):
+    if fmt == 'unified' and len(specs) != 2:
+        raise ValueError('unified diffs need exactly two files')
+    if all(os.path.isdir(name) for name, encodings, label in specs):
+        return _run_dirs(out, fmt, specs, context, trust_mtime)
+    labels = [ name if label is None else label for name, encodings, label in specs ]
+    fc, approximate = compare(specs, cache_dir)
+    return _write_results(out, fmt, fc, approximate, labels, context)
+
+# entry point for 'diffuse --batch', the arguments are parsed like the
+# interactive ones and each group of files separated by '-t' is compared in
+# turn, returns the exit code
+def main(argv, out=None, err=None):
+    if out is None:
+        out = sys.stdout
+    if err is None:
+        err = sys.stderr
+    fmt, context, groups, manifest, jobs, trust_mtime, cache_dir = 'unified', 3, [], None, None, False, None
+    i, specs, encodings, label = 0, [], [ 'utf_8' ], None
+    while i < len(argv):
+        arg = argv[i]
+        i += 1
+
+        if arg == '--batch':
+            pass
+        elif arg == '--format':
+            # select the output format
+            if i < len(argv):
+                fmt = argv[i]
+                i += 1
+            if fmt not in FORMATS:
+                err.write('diffuse: unknown format %s, expected one of %s\n' % (repr(fmt), ', '.join(FORMATS)))
+                return TROUBLE
+        elif arg == '--manifest':
+            # compare the entries listed in a file, '-' reads stdin
+            if i < len(argv):
+                manifest = argv[i]
+                i += 1
+        elif arg == '-j':
+            # number of worker processes for manifests
+            if i < len(argv):
+                try:
+                    jobs = max(int(argv[i]), 1)
+                except ValueError:
+                    err.write('diffuse: invalid number of jobs %s\n' % (repr(argv[i]), ))
+                    return TROUBLE
+                i += 1
+        elif arg == '--cache-dir':
+            # reuse alignments stored in a directory
+            if i < len(argv):
+                cache_dir = argv[i]
+                i += 1
+        elif arg == '--trust-mtime':
+            # treat files in directory trees with the same size and
+            # modification time as identical without reading them
+            trust_mtime = True
+        elif arg == '-U':
+            # lines of context for unified diffs
+            if i < len(argv):
+                try:
+                    context = max(int(argv[i]), 0)
+                except ValueError:
+                    err.write('diffuse: invalid context length %s\n' % (repr(argv[i]), ))
+                    return TROUBLE
+                i += 1
+        elif arg == '-t':
+            # start new comparison
+            if len(specs):
+                groups.append(specs)
+                specs = []
+        elif arg == '-e':
+            # specify encoding
+            if i < len(argv):
+                encodings = argv[i].split(' ')
+                i += 1
+        elif arg == '-l':
+            # set file label
+            if i < len(argv):
+                label = argv[i]
+                i += 1
+        else:
+            # given file name
+            specs.append((arg, encodings, label))
+            label = None
+    if len(specs):
+        groups.append(specs)
+
+    if manifest is not None:
+        try:
+            if manifest == '-':
+                entries = list(read_manifest(sys.stdin, encodings))
+            else:
+                with open(manifest, 'r', encoding='utf-8') as f:
+                    entries = list(read_manifest(f, encodings))
+        except (OSError, ValueError) as e:
+            err.write('diffuse: %s\n' % (e, ))
+            return TROUBLE
+        entries.extend([ ([ name for name, encodings, label in specs ], specs[0][1]) for specs in groups ])
+        return run_manifest(out, entries, jobs, cache_dir)
+
+    result = SAME
+    for specs in groups:
+        if len(specs) < 2:
+            err.write('diffuse: batch comparisons need at least two files\n')
+            result = TROUBLE
+            continue
+        try:
+            result = max(result, _run(out, fmt, specs, context, trust_mtime, cache_dir))
+        except (OSError, UnicodeDecodeError, ValueError) as e:
+            err.write('diffuse: %s\n' % (e, ))
+            result = TROUBLE
+    if not groups:
+        err.write('diffuse: no files to compare\n')
+        result = TROUBLE
+    return result
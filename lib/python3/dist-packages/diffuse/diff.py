@@ -17,6 +17,34 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import array, time
+
+# maps each distinct line to a small integer so the diff algorithms only need
+# to hash and compare ints
+class Tokenizer:
+    def __init__(self):
+        self._tokens = {}
+
+    def __repr__(self):
+        return '<Tokenizer n=%d/>' % (len(self._tokens), )
+
+    def size(self):
+        return len(self._tokens)
+
+    def clear(self):
+        self._tokens.clear()
+
+    def tokenize(self, ss):
+        tokens = self._tokens
+        get, result = tokens.get, array.array('l')
+        append = result.append
+        for s in ss:
+            t = get(s)
+            if t is None:
+                tokens[s] = t = len(tokens)
+            append(t)
+        return result
+
 # longest common subsequence of unique elements common to 'a' and 'b'
 def _patience_subsequence(a, b):
     # value unique lines by their order in each list
@@ -72,8 +100,108 @@ def _patience_subsequence(a, b):
         result.reverse()
     return result
 
+# default limit on the number of comparisons made by _lcs_approx for a
+# single block
+_LCS_MAX_COST = 1000000
+
+# default limit on the comparisons made by the Myers and histogram engines
+# over a whole diff, it grows by the cost per element for each element of
+# the inputs so large files get a proportional budget
+_MAX_TOTAL_COST = 2000000
+_TOTAL_COST_PER_ELEMENT = 64
+
+# limits the work done by the diff algorithms and records whether the result
+# had to be approximated to stay within the limits
+class Budget:
+    def __init__(self, max_cost=_LCS_MAX_COST, timeout=None, cancel_event=None, max_total_cost=_MAX_TOTAL_COST, cost_per_element=_TOTAL_COST_PER_ELEMENT):
+        # maximum number of comparisons per block or None
+        self._max_cost = max_cost
+        # maximum number of comparisons charged over all blocks or None
+        self._max_total_cost = max_total_cost
+        self._cost_per_element = cost_per_element
+        self._sized = False
+        self._total_cost = 0
+        # wall-clock deadline or None
+        self._deadline = None if timeout is None else time.monotonic() + timeout
+        # optional threading.Event that expires the budget once set
+        self._cancel_event = cancel_event
+        self._approximate = False
+
+    def __repr__(self):
+        return '<Budget max_cost=%s, deadline=%s, approximate=%s/>' % (repr(self._max_cost), repr(self._deadline), repr(self._approximate))
+
+    def get_max_cost(self):
+        return self._max_cost
+
+    # grow the total limit for inputs with 'n' elements, only the first call
+    # counts as engines call it again for the sections they recurse on
+    def set_input_size(self, n):
+        if not self._sized:
+            self._sized = True
+            if self._max_total_cost is not None:
+                self._max_total_cost += self._cost_per_element * n
+
+    # add to the comparisons made over all blocks, returns True once they
+    # exceed the limit
+    def charge(self, cost):
+        self._total_cost += cost
+        return self._max_total_cost is not None and self._total_cost > self._max_total_cost
+
+    def get_total_cost(self):
+        return self._total_cost
+
+    # true if no more comparisons should be made, callers then fall back to
+    # a linear approximation
+    def is_exhausted(self):
+        if self._max_total_cost is not None and self._total_cost > self._max_total_cost:
+            return True
+        return self.expired()
+
+    def expired(self):
+        if self._cancel_event is not None and self._cancel_event.is_set():
+            return True
+        return self._deadline is not None and time.monotonic() > self._deadline
+
+    # plain values to build a budget for 'share' of the remaining cost in
+    # another process, the cancel event cannot be sent so the copy only
+    # sees the time left
+    def get_limits(self, share=1):
+        timeout, max_total_cost = None, None
+        if self._deadline is not None:
+            timeout = max(self._deadline - time.monotonic(), 0)
+        if self._max_total_cost is not None:
+            max_total_cost = int(max(self._max_total_cost - self._total_cost, 0) * share)
+        return self._max_cost, timeout, max_total_cost
+
+    def set_approximate(self):
+        self._approximate = True
+
+    def is_approximate(self):
+        return self._approximate
+
+# cheap fallback for _lcs_approx when the budget runs out: the longest match
+# starting at one of the first few common elements
+def _lcs_anchor(a, b, lookup):
+    aidx, bidx, nidx, candidates = 0, 0, 0, 64
+    len_a, len_b = len(a), len(b)
+    for ai, s in enumerate(a):
+        if s in lookup:
+            bi = lookup[s][0]
+            n = 1
+            while ai + n < len_a and bi + n < len_b and a[ai + n] == b[bi + n]:
+                n += 1
+            if n > nidx:
+                aidx, bidx, nidx = ai, bi, n
+            candidates -= 1
+            if candidates == 0:
+                break
+    if nidx:
+        return aidx, bidx, nidx
+
 # difflib-style approximation of the longest common subsequence
-def _lcs_approx(a, b):
+def _lcs_approx(a, b, budget=None):
+    if budget is None:
+        budget = Budget()
     count1, lookup = {}, {}
     # count occurances of each element in 'a'
     for s in a:
@@ -84,7 +212,8 @@ def _lcs_approx(a, b):
             lookup[s].append(i)
         else:
             lookup[s] = [ i ]
-    if set(lookup).intersection(count1):
+    common, exhausted = set(lookup).intersection(count1), False
+    if common:
         # we have some common elements
         # identify popular entries
         popular = {}
@@ -98,27 +227,43 @@ def _lcs_approx(a, b):
             for k, v in lookup.items():
                 if 100 * len(v) > n:
                     popular[k] = 1
+        # adaptively treat the most expensive entries as popular until the
+        # estimated number of comparisons fits in the budget
+        max_cost = budget.get_max_cost()
+        if max_cost is not None:
+            costs = [ (count1[k] * len(lookup[k]), k) for k in common if k not in popular ]
+            cost = sum([ c for c, k in costs ])
+            if cost > max_cost:
+                exhausted = True
+                costs.sort(key=lambda t: t[0], reverse=True)
+                for c, k in costs:
+                    popular[k] = 1
+                    cost -= c
+                    if cost <= max_cost:
+                        break
         # while walk through entries in 'a', incrementally update the list of
         # matching subsequences in 'b' and keep track of the longest match
         # found
-        prev_matches, matches, max_length, max_indices = {}, {}, 0, []
+        prev_matches, matches, max_length, max_indices, cost = {}, {}, 0, [], 0
         for ai, s in enumerate(a):
             if s in lookup:
                 if s in popular:
                     # we only extend existing previously found matches to avoid
                     # performance issues
+                    cost += len(prev_matches)
                     for bi in prev_matches:
                         if bi + 1 < n and b[bi + 1] == s:
-                            matches[bi] = v = prev_matches[bi] + 1
+                            matches[bi + 1] = v = prev_matches[bi] + 1
                             # check if this is now the longest match
                             if v >= max_length:
                                 if v == max_length:
-                                    max_indices.append((ai, bi))
+                                    max_indices.append((ai, bi + 1))
                                 else:
                                     max_length = v
-                                    max_indices = [ (ai, bi) ]
+                                    max_indices = [ (ai, bi + 1) ]
                 else:
                     prev_get = prev_matches.get
+                    cost += len(lookup[s])
                     for bi in lookup[s]:
                         matches[bi] = v = prev_get(bi - 1, 0) + 1
                         # check if this is now the longest match
@@ -129,6 +274,12 @@ def _lcs_approx(a, b):
                                 max_length = v
                                 max_indices = [ (ai, bi) ]
             prev_matches, matches = matches, {}
+            # stop early if we have run out of budget
+            if (max_cost is not None and cost > max_cost) or ((ai & 0xff) == 0xff and budget.expired()):
+                exhausted = True
+                break
+        if exhausted:
+            budget.set_approximate()
         if max_indices:
             # include any popular entries at the beginning
             aidx, bidx, nidx = 0, 0, 0
@@ -143,60 +294,120 @@ def _lcs_approx(a, b):
                 if n > nidx:
                     aidx, bidx, nidx = ai, bi, n
             return aidx, bidx, nidx
+        if exhausted:
+            return _lcs_anchor(a, b, lookup)
 
-# patinence diff with difflib-style fallback
-def patience_diff(a, b):
-    matches, len_a, len_b = [], len(a), len(b)
-    if len_a and len_b:
-        blocks = [ (0, len_a, 0, len_b, 0) ]
-        while blocks:
-            start_a, end_a, start_b, end_b, match_idx = blocks.pop()
-            aa, bb = a[start_a:end_a], b[start_b:end_b]
-            # try patience
-            pivots = _patience_subsequence(aa, bb)
-            if pivots:
-                offset_a, offset_b = start_a, start_b
-                for pivot_a, pivot_b in pivots:
-                    pivot_a += offset_a
-                    pivot_b += offset_b
-                    if start_a <= pivot_a:
-                        # extend before
-                        idx_a, idx_b = pivot_a, pivot_b
-                        while start_a < idx_a and start_b < idx_b and a[idx_a - 1] == b[idx_b - 1]:
-                            idx_a -= 1
-                            idx_b -= 1
-                        # if anything is before recurse on the section
-                        if start_a < idx_a and start_b < idx_b:
-                            blocks.append((start_a, idx_a, start_b, idx_b, match_idx))
-                        # extend after
-                        start_a, start_b = pivot_a + 1, pivot_b + 1
-                        while start_a < end_a and start_b < end_b and a[start_a] == b[start_b]:
-                            start_a += 1
-                            start_b += 1
-                        # record match
-                        matches.insert(match_idx, (idx_a, idx_b, start_a - idx_a))
-                        match_idx += 1
-                # if anything is after recurse on the section
-                if start_a < end_a and start_b < end_b:
-                    blocks.append((start_a, end_a, start_b, end_b, match_idx))
-            else:
-                # fallback if patience fails
-                pivots = _lcs_approx(aa, bb)
-                if pivots:
-                    idx_a, idx_b, n = pivots
-                    idx_a += start_a
-                    idx_b += start_b
+# solve the sections of a patience diff on the 'blocks' stack, sections
+# found after the first pass are added to 'deferred' instead when it is given
+# matches are appended in no particular order and must be sorted afterwards
+def _patience_blocks(a, b, blocks, matches, budget, deferred=None):
+    append = matches.append
+    while blocks:
+        # sections left unsolved once cancelled are reported as differences
+        if budget.expired():
+            budget.set_approximate()
+            break
+        start_a, end_a, start_b, end_b = blocks.pop()
+        aa, bb = a[start_a:end_a], b[start_b:end_b]
+        # try patience
+        pivots = _patience_subsequence(aa, bb)
+        if pivots:
+            offset_a, offset_b = start_a, start_b
+            for pivot_a, pivot_b in pivots:
+                pivot_a += offset_a
+                pivot_b += offset_b
+                if start_a <= pivot_a:
+                    # extend before
+                    idx_a, idx_b = pivot_a, pivot_b
+                    while start_a < idx_a and start_b < idx_b and a[idx_a - 1] == b[idx_b - 1]:
+                        idx_a -= 1
+                        idx_b -= 1
                     # if anything is before recurse on the section
                     if start_a < idx_a and start_b < idx_b:
-                        blocks.append((start_a, idx_a, start_b, idx_b, match_idx))
+                        blocks.append((start_a, idx_a, start_b, idx_b))
+                    # extend after
+                    start_a, start_b = pivot_a + 1, pivot_b + 1
+                    while start_a < end_a and start_b < end_b and a[start_a] == b[start_b]:
+                        start_a += 1
+                        start_b += 1
                     # record match
-                    matches.insert(match_idx, (idx_a, idx_b, n))
-                    match_idx += 1
-                    idx_a += n
-                    idx_b += n
-                    # if anything is after recurse on the section
-                    if idx_a < end_a and idx_b < end_b:
-                        blocks.append((idx_a, end_a, idx_b, end_b, match_idx))
+                    append((idx_a, idx_b, start_a - idx_a))
+            # if anything is after recurse on the section
+            if start_a < end_a and start_b < end_b:
+                blocks.append((start_a, end_a, start_b, end_b))
+        else:
+            # fallback if patience fails
+            pivots = _lcs_approx(aa, bb, budget)
+            if pivots:
+                idx_a, idx_b, n = pivots
+                idx_a += start_a
+                idx_b += start_b
+                # if anything is before recurse on the section
+                if start_a < idx_a and start_b < idx_b:
+                    blocks.append((start_a, idx_a, start_b, idx_b))
+                # record match
+                append((idx_a, idx_b, n))
+                idx_a += n
+                idx_b += n
+                # if anything is after recurse on the section
+                if idx_a < end_a and idx_b < end_b:
+                    blocks.append((idx_a, end_a, idx_b, end_b))
+        if deferred is not None:
+            deferred.extend(blocks)
+            del blocks[:]
+
+# solve an independent section of a patience diff in a worker process, the
+# limits are those of Budget.get_limits() as a Budget cannot be pickled,
+# returns the matches, whether they are approximate, and the cost charged
+def _patience_section(a, b, max_cost, timeout, max_total_cost):
+    budget, matches = Budget(max_cost, timeout, None, max_total_cost, 0), []
+    _patience_blocks(a, b, [ (0, len(a), 0, len(b)) ], matches, budget)
+    return matches, budget.is_approximate(), budget.get_total_cost()
+
+# minimum combined size of a section for it to be sent to a worker process
+_PARALLEL_THRESHOLD = 100000
+
+# patinence diff with difflib-style fallback, sections left after the first
+# pass may be solved in parallel by passing a concurrent.futures executor
+def patience_diff(a, b, budget=None, executor=None, threshold=_PARALLEL_THRESHOLD):
+    if budget is None:
+        budget = Budget()
+    matches, len_a, len_b = [], len(a), len(b)
+    if len_a and len_b:
+        blocks = [ (0, len_a, 0, len_b) ]
+        if executor is None:
+            _patience_blocks(a, b, blocks, matches, budget)
+        else:
+            deferred = []
+            _patience_blocks(a, b, blocks, matches, budget, deferred)
+            # sections are independent so large ones are farmed out while
+            # the small ones are solved here
+            sizes = [ end_a - start_a + end_b - start_b for start_a, end_a, start_b, end_b in deferred ]
+            total = sum([ size for size in sizes if size >= threshold ])
+            futures = []
+            for (start_a, end_a, start_b, end_b), size in zip(deferred, sizes):
+                if size >= threshold:
+                    # each worker gets a share of the remaining cost for
+                    # the size of its section
+                    futures.append(executor.submit(_patience_section, a[start_a:end_a], b[start_b:end_b], *budget.get_limits(size / total)))
+                else:
+                    futures.append(None)
+            # collect the results of each section
+            for block, future in zip(deferred, futures):
+                start_a, end_a, start_b, end_b = block
+                section = []
+                if future is None:
+                    _patience_blocks(a[start_a:end_a], b[start_b:end_b], [ (0, end_a - start_a, 0, end_b - start_b) ], section, budget)
+                elif budget.expired() and future.cancel():
+                    budget.set_approximate()
+                else:
+                    section, approximate, cost = future.result()
+                    budget.charge(cost)
+                    if approximate:
+                        budget.set_approximate()
+                matches.extend([ (idx_a + start_a, idx_b + start_b, n) for idx_a, idx_b, n in section ])
+        # the matches are disjoint so sorting puts them in order
+        matches.sort()
     # try matching from begining to first match block
     if matches:
         end_a, end_b = matches[0][:2]
@@ -206,7 +417,7 @@ def patience_diff(a, b):
     while i < end_a and i < end_b and a[i] == b[i]:
         i += 1
     if i:
-        matches.insert(0, (0, 0, i))
+        matches = [ (0, 0, i) ] + matches
     # try matching from last match block to end
     if matches:
         start_a, start_b, n = matches[-1]
@@ -223,3 +434,214 @@ def patience_diff(a, b):
     # add a zero length block to the end
     matches.append((len_a, len_b, 0))
     return matches
+
+# merge adjacent matches and add the zero length block to the end
+def _finish_matches(matches, len_a, len_b):
+    matches.sort()
+    result = []
+    for m in matches:
+        if result:
+            idx_a, idx_b, n = result[-1]
+            if idx_a + n == m[0] and idx_b + n == m[1]:
+                result[-1] = (idx_a, idx_b, n + m[2])
+                continue
+        result.append(m)
+    result.append((len_a, len_b, 0))
+    return result
+
+# find the middle snake of an edit script for a[start_a:end_a] and
+# b[start_b:end_b] whose first and last elements differ, if the budget runs
+# out first the furthest reaching forward path is used as a split point
+# instead, the diagonals visited are charged to the budget
+def _middle_snake(a, b, start_a, end_a, start_b, end_b, budget):
+    n, m = end_a - start_a, end_b - start_b
+    delta = n - m
+    odd = delta & 1
+    offset = n + m + 2
+    vf, vb = (2 * offset + 1) * [ 0 ], (2 * offset + 1) * [ 0 ]
+    for d in range((n + m + 1) // 2 + 1):
+        # forward path
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and vf[offset + k - 1] < vf[offset + k + 1]):
+                x = vf[offset + k + 1]
+            else:
+                x = vf[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[start_a + x] == b[start_b + y]:
+                x += 1
+                y += 1
+            vf[offset + k] = x
+            c = delta - k
+            if odd and -d < c < d and x + vb[offset + c] >= n:
+                return x0, y0, x, y
+        # reverse path
+        for c in range(-d, d + 1, 2):
+            if c == -d or (c != d and vb[offset + c - 1] < vb[offset + c + 1]):
+                x = vb[offset + c + 1]
+            else:
+                x = vb[offset + c - 1] + 1
+            y = x - c
+            x0, y0 = x, y
+            while x < n and y < m and a[end_a - 1 - x] == b[end_b - 1 - y]:
+                x += 1
+                y += 1
+            vb[offset + c] = x
+            k = delta - c
+            if not odd and -d <= k <= d and x + vf[offset + k] >= n:
+                return n - x, m - y, n - x0, m - y0
+        if budget.charge(2 * d + 2) or ((d & 0x3f) == 0x3f and budget.expired()):
+            budget.set_approximate()
+            x, y = 0, 0
+            for k in range(-d, d + 1, 2):
+                xk = vf[offset + k]
+                yk = xk - k
+                if xk <= n and yk <= m and xk + yk > x + y:
+                    x, y = xk, yk
+            if 0 < x + y < n + m:
+                return x, y, x, y
+            return None
+
+# cheap fallback once the budget is exhausted: match the elements that are
+# unique to both sections and extend each match forwards in a single pass
+def _anchor_matches(a, b, start_a, end_a, start_b, end_b, matches):
+    next_a, next_b = start_a, start_b
+    for idx_a, idx_b in _patience_subsequence(a[start_a:end_a], b[start_b:end_b]):
+        idx_a += start_a
+        idx_b += start_b
+        # skip anchors covered by the previous match
+        if idx_a < next_a or idx_b < next_b:
+            continue
+        n = 1
+        while idx_a + n < end_a and idx_b + n < end_b and a[idx_a + n] == b[idx_b + n]:
+            n += 1
+        matches.append((idx_a, idx_b, n))
+        next_a, next_b = idx_a + n, idx_b + n
+
+# linear space variant of Myers' O(ND) difference algorithm, once the budget
+# is exhausted the remaining sections are only matched on their common prefix,
+# suffix and unique elements
+def myers_diff(a, b, budget=None):
+    if budget is None:
+        budget = Budget()
+    matches, len_a, len_b = [], len(a), len(b)
+    budget.set_input_size(len_a + len_b)
+    blocks = [ (0, len_a, 0, len_b) ]
+    exhausted = budget.is_exhausted()
+    while blocks:
+        start_a, end_a, start_b, end_b = blocks.pop()
+        # match common prefix and suffix
+        i = start_a
+        while start_a < end_a and start_b < end_b and a[start_a] == b[start_b]:
+            start_a += 1
+            start_b += 1
+        if start_a > i:
+            matches.append((i, start_b - start_a + i, start_a - i))
+        i = end_a
+        while start_a < end_a and start_b < end_b and a[end_a - 1] == b[end_b - 1]:
+            end_a -= 1
+            end_b -= 1
+        if end_a < i:
+            matches.append((end_a, end_b, i - end_a))
+        if start_a < end_a and start_b < end_b and exhausted:
+            budget.set_approximate()
+            _anchor_matches(a, b, start_a, end_a, start_b, end_b, matches)
+        elif start_a < end_a and start_b < end_b:
+            # split on the middle snake
+            snake = _middle_snake(a, b, start_a, end_a, start_b, end_b, budget)
+            exhausted = budget.is_exhausted()
+            if snake is None:
+                # give up on the rest of this section
+                continue
+            x0, y0, x1, y1 = snake
+            if x1 > x0:
+                matches.append((start_a + x0, start_b + y0, x1 - x0))
+            blocks.append((start_a, start_a + x0, start_b, start_b + y0))
+            blocks.append((start_a + x1, end_a, start_b + y1, end_b))
+    return _finish_matches(matches, len_a, len_b)
+
+# maximum number of occurrences of an element for it to be used as a pivot
+# by the histogram diff
+_HISTOGRAM_MAX_CHAIN = 64
+
+# find the matching region containing the least frequently occurring
+# elements, the elements examined are charged to the budget
+def _histogram_region(a, b, start_a, end_a, start_b, end_b, budget):
+    cost, occurrences = end_a - start_a + end_b - start_b, {}
+    for i in range(start_a, end_a):
+        s = a[i]
+        if s in occurrences:
+            occurrences[s].append(i)
+        else:
+            occurrences[s] = [ i ]
+    result, best_count, best_n = None, _HISTOGRAM_MAX_CHAIN + 1, 0
+    idx_b = start_b
+    while idx_b < end_b:
+        next_b = idx_b + 1
+        positions = occurrences.get(b[idx_b])
+        if positions is not None and len(positions) <= best_count:
+            for idx_a in positions:
+                # extend the match in both directions while tracking the
+                # lowest occurrence count in the region
+                rc = len(positions)
+                ia, ib, ea, eb = idx_a, idx_b, idx_a + 1, idx_b + 1
+                while start_a < ia and start_b < ib and a[ia - 1] == b[ib - 1]:
+                    ia -= 1
+                    ib -= 1
+                    rc = min(rc, len(occurrences[a[ia]]))
+                while ea < end_a and eb < end_b and a[ea] == b[eb]:
+                    rc = min(rc, len(occurrences[a[ea]]))
+                    ea += 1
+                    eb += 1
+                cost += ea - ia
+                if next_b < eb:
+                    next_b = eb
+                if ea - ia > best_n or rc < best_count:
+                    result, best_count, best_n = (ia, ib, ea - ia), rc, ea - ia
+        idx_b = next_b
+    budget.charge(cost)
+    return result
+
+# git-style histogram diff with Myers fallback for ranges that only contain
+# frequently occurring elements, both share the budget and the remaining
+# ranges are left to Myers' fallback once it is exhausted
+def histogram_diff(a, b, budget=None):
+    if budget is None:
+        budget = Budget()
+    matches, len_a, len_b = [], len(a), len(b)
+    budget.set_input_size(len_a + len_b)
+    blocks = [ (0, len_a, 0, len_b) ]
+    while blocks:
+        start_a, end_a, start_b, end_b = blocks.pop()
+        if start_a < end_a and start_b < end_b:
+            region = None
+            if not budget.is_exhausted():
+                region = _histogram_region(a, b, start_a, end_a, start_b, end_b, budget)
+            if region is None:
+                for idx_a, idx_b, n in myers_diff(a[start_a:end_a], b[start_b:end_b], budget):
+                    if n:
+                        matches.append((idx_a + start_a, idx_b + start_b, n))
+            else:
+                idx_a, idx_b, n = region
+                matches.append(region)
+                blocks.append((start_a, idx_a, start_b, idx_b))
+                blocks.append((idx_a + n, end_a, idx_b + n, end_b))
+    return _finish_matches(matches, len_a, len_b)
+
+# registry of diff engines, each taking two sequences and an optional Budget
+# and returning a list of (idx_a, idx_b, n) match blocks terminated by a zero
+# length block
+_engines = {}
+
+def register_engine(name, engine):
+    _engines[name] = engine
+
+def get_engine(name):
+    return _engines[name]
+
+def get_engine_names():
+    return sorted(_engines.keys())
+
+register_engine('patience', patience_diff)
+register_engine('myers', myers_diff)
+register_engine('histogram', histogram_diff)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Derrick Moser <derrick_moser@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import array, os, re, struct
+
+# default limit on the total size of a cache directory
+_MAX_SIZE = 1 << 28
+
+# entries start with this and a header of the number of blocks and panes,
+# the blocks follow and then each pane's spacer layout as a count of runs
+# and the lengths of alternating runs of lines and spacers
+_MAGIC = b'diffuse-diff-cache-1\n'
+_HEADER = struct.Struct('<QQ')
+_COUNT = struct.Struct('<Q')
+
+# lengths of the alternating runs of zero and non-zero flags, starting with
+# a possibly empty run of zeros
+def encode_runs(flags):
+    runs, i = array.array('q'), 0
+    for m in re.finditer(b'\x00+', flags):
+        start, end = m.span()
+        if start > i:
+            if not runs:
+                runs.append(0)
+            runs.append(start - i)
+        runs.append(end - start)
+        i = end
+    if i < len(flags):
+        if not runs:
+            runs.append(0)
+        runs.append(len(flags) - i)
+    return runs
+
+def decode_runs(runs):
+    result = bytearray()
+    for i, n in enumerate(runs):
+        result.extend((i & 1).to_bytes(1, 'little') * n)
+    return result
+
+def _read_array(f, n):
+    a = array.array('q')
+    a.fromfile(f, n)
+    return a
+
+# alignments stored as one file per key in a directory, the least recently
+# used files are removed when the directory grows beyond 'max_size' bytes
+class DiffCache:
+    def __init__(self, cache_dir, max_size=_MAX_SIZE):
+        self._cache_dir = cache_dir
+        self._max_size = max_size
+        # estimated size of the directory, None until it is first scanned,
+        # other processes may add entries so it is scanned again once the
+        # estimate reaches the limit
+        self._size = None
+
+    def __repr__(self):
+        return '<DiffCache cache_dir=%s, max_size=%d/>' % (repr(self._cache_dir), self._max_size)
+
+    def _get_path(self, key):
+        return os.path.join(self._cache_dir, key.hex() + '.diff')
+
+    # the blocks and spacer flags of each pane stored for 'key' or None
+    def get(self, key):
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                if f.read(len(_MAGIC)) != _MAGIC:
+                    return None
+                nblocks, npanes = _HEADER.unpack(f.read(_HEADER.size))
+                blocks, spacers = _read_array(f, nblocks), []
+                for p in range(npanes):
+                    n, = _COUNT.unpack(f.read(_COUNT.size))
+                    spacers.append(decode_runs(_read_array(f, n)))
+            # record the use for eviction
+            os.utime(path)
+        except (OSError, EOFError, struct.error):
+            return None
+        return blocks, spacers
+
+    def put(self, key, blocks, spacers):
+        path = self._get_path(key)
+        os.makedirs(self._cache_dir, exist_ok=True)
+        # write to a temporary file so readers never see a partial entry
+        temp = '%s.%d' % (path, os.getpid())
+        try:
+            with open(temp, 'wb') as f:
+                f.write(_MAGIC)
+                f.write(_HEADER.pack(len(blocks), len(spacers)))
+                array.array('q', blocks).tofile(f)
+                for flags in spacers:
+                    runs = encode_runs(flags)
+                    f.write(_COUNT.pack(len(runs)))
+                    runs.tofile(f)
+                size = f.tell()
+            try:
+                size -= os.stat(path).st_size
+            except OSError:
+                pass
+            os.replace(temp, path)
+            temp = None
+        finally:
+            if temp is not None:
+                try:
+                    os.remove(temp)
+                except OSError:
+                    pass
+        if self._size is not None:
+            self._size += size
+        if self._size is None or self._size > self._max_size:
+            self.evict()
+
+    # remove the least recently used entries until the cache fits, a full
+    # cache is cut to three quarters of its limit so it is not scanned again
+    # on each of the next writes
+    def evict(self):
+        entries, total = [], 0
+        try:
+            with os.scandir(self._cache_dir) as it:
+                for entry in it:
+                    if entry.name.endswith('.diff') and entry.is_file():
+                        st = entry.stat()
+                        entries.append((st.st_mtime_ns, st.st_size, entry.path))
+                        total += st.st_size
+        except OSError:
+            return
+        self._size = total
+        if total <= self._max_size:
+            return
+        entries.sort()
+        limit = self._max_size * 3 // 4
+        for mtime, size, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self._size = total
+            if total <= limit:
+                break
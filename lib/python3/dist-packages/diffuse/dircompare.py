@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Derrick Moser <derrick_moser@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import concurrent.futures, os
+
+import diffuse.filecompare, diffuse.reader
+
+# states of the entries of a directory comparison, files missing from the
+# first tree were added and files missing from any other tree were removed
+ADDED, REMOVED, SAME, CHANGED = range(4)
+STATE_NAMES = ('added', 'removed', 'same', 'changed')
+
+# sizes and modification times of the regular files below 'root' keyed by
+# their '/' separated path relative to 'root', symbolic links to directories
+# are not followed, scanning stops once the optional threading.Event
+# 'cancel_event' is set
+def scan_tree(root, cancel_event=None):
+    files, stack = {}, [ '' ]
+    while stack:
+        if cancel_event is not None and cancel_event.is_set():
+            break
+        rel = stack.pop()
+        try:
+            it = os.scandir(os.path.join(root, rel) if rel else root)
+        except OSError:
+            continue
+        with it:
+            for entry in it:
+                name = rel + entry.name
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(name + '/')
+                    elif entry.is_file():
+                        # only Windows fills this in while scanning, it is a
+                        # system call elsewhere
+                        st = entry.stat()
+                        files[name] = st.st_size, st.st_mtime_ns
+                except OSError:
+                    pass
+    return files
+
+def _get_digests(names):
+    try:
+        return [ diffuse.reader.digest(name) for name in names ]
+    except OSError:
+        return None
+
+# classify the files of two or three directory trees, files with matching
+# sizes are hashed in a thread pool unless 'trust_mtime' is set and their
+# modification times also match, checkouts often give different files the
+# same time so this is off by default, files are only loaded into a
+# FileCompare when asked for
+class DirCompare:
+    def __init__(self, roots, encodings=None, trust_mtime=False, executor=None):
+        self._roots = roots
+        self._encodings = [ 'utf_8' ] if encodings is None else encodings
+        self._trust_mtime = trust_mtime
+        # optional concurrent.futures executor for hashing
+        self._executor = executor
+        # files found in each tree by the last scan
+        self._trees = [ {} for root in roots ]
+        # sorted (path, state) tuples
+        self._entries = []
+        # FileCompare of each entry that has been opened
+        self._file_compares = {}
+        # entries whose alignment had to be approximated
+        self._approximate = set()
+        # optional threading.Event that stops a scan once set
+        self._cancel_event = None
+
+    def __repr__(self):
+        return '<DirCompare roots=%s, entries=%s/>' % (repr(self._roots), repr(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def set_cancel_event(self, event):
+        self._cancel_event = event
+
+    def is_cancelled(self):
+        return self._cancel_event is not None and self._cancel_event.is_set()
+
+    # the entries are incomplete if the scan is cancelled
+    def scan(self):
+        self._trees = trees = [ scan_tree(root, self._cancel_event) for root in self._roots ]
+        paths = set()
+        for tree in trees:
+            paths.update(tree)
+        entries, pending = [], []
+        for path in sorted(paths):
+            stats = [ tree.get(path) for tree in trees ]
+            if stats[0] is None:
+                state = ADDED
+            elif None in stats:
+                state = REMOVED
+            elif any(st[0] != stats[0][0] for st in stats):
+                state = CHANGED
+            elif self._trust_mtime and all(st[1] == stats[0][1] for st in stats):
+                state = SAME
+            else:
+                # same size, compare the contents
+                state = None
+                pending.append(len(entries))
+            entries.append([ path, state ])
+        if pending:
+            names = [ self.get_names(entries[i][0]) for i in pending ]
+            executor = self._executor
+            if executor is None:
+                executor = concurrent.futures.ThreadPoolExecutor(min(len(pending), 8))
+            try:
+                for i, digests in zip(pending, executor.map(_get_digests, names)):
+                    if self.is_cancelled():
+                        break
+                    same = digests is not None and all(d == digests[0] for d in digests)
+                    entries[i][1] = SAME if same else CHANGED
+            finally:
+                if executor is not self._executor:
+                    executor.shutdown()
+        self._entries = [ tuple(e) for e in entries ]
+        self._file_compares = {}
+        self._approximate = set()
+
+    def get_roots(self):
+        return self._roots
+
+    def get_encodings(self):
+        return self._encodings
+
+    # sorted (path, state) tuples
+    def get_entries(self):
+        return self._entries
+
+    # file name of 'path' in each tree as of the last scan or None where it is missing
+    def get_names(self, path):
+        parts = path.split('/')
+        return [ os.path.join(root, *parts) if path in tree else None for root, tree in zip(self._roots, self._trees) ]
+
+    # aligned contents of the i-th entry, loaded the first time it is asked
+    # for
+    def get_file_compare(self, i):
+        fc = self._file_compares.get(i)
+        if fc is None:
+            names = self.get_names(self._entries[i][0])
+            fc = diffuse.filecompare.FileCompare(len(names))
+            for p, name in enumerate(names):
+                if name is not None:
+                    fc.load_file(p, name, self._encodings)
+                    if fc.is_approximate():
+                        self._approximate.add(i)
+            self._file_compares[i] = fc
+        return fc
+
+    # true if any diff made while loading the i-th entry had to be
+    # approximated
+    def is_approximate(self, i):
+        return i in self._approximate
@@ -17,39 +17,35 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
-import os
-import diffuse.signal, diffuse.undo, diffuse.diff
-
-# split into lines on either Mac, Windows, or Unix line endings
-def _split_lines(s):
-    i, n, sf, ss, cr, nl = 0, len(s), s.find, [], -1, -1
-    sa = ss.append
-    while i < n:
-        if cr < i:
-            # find the next '\r'
-            cr = sf('\r', i)
-            if cr == -1:
-                cr = n
-        if nl < i:
-            # find the next '\n'
-            nl = sf('\n', i)
-            if nl == -1:
-                nl = n
-        if cr < nl:
-            # found Mac or Windows line ending
-            if cr + 1 < n and s[cr + 1] == '\n':
-                # it is a Windows line ending
-                cr += 1
-            sa(s[i:cr + 1])
-            i = cr + 1
-        else:
-            # found Unix line ending or EOF
-            if nl == n:
-                # it is EOF
-                nl -= 1
-            sa(s[i:nl + 1])
-            i = nl + 1
-    return ss
+import array, codecs, hashlib, os
+import diffuse.signal, diffuse.undo, diffuse.diff, diffuse.reader, diffuse.linestore, diffuse.rope, diffuse.lineindex
+
+# NumPy is optional and only used to speed up alignment of large files
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# minimum number of rows before alignment uses NumPy
+_NUMPY_MIN_ROWS = 1000
+
+# maximum number of rows searched on each side of an edit for an anchor row
+_ANCHOR_SEARCH_LIMIT = 1000
+
+# size in bytes of the chunks of a file checksummed to detect appends on
+# reload
+_RELOAD_CHUNK_SIZE = 1 << 16
+
+# the token table is cleared once it holds this many times the number of
+# lines in the panes and being diffed
+_TOKENIZER_GROWTH = 4
+
+# default minimum size in bytes of files read through a line index
+_HUGE_FILE_SIZE = 1 << 28
+
+# part of every diff cache key, change this whenever alignment results
+# change so old entries are not used
+_DIFF_CACHE_VERSION = 1
 
 def _make_block(n):
     return [ n ] if n else []
@@ -72,14 +68,172 @@ def _cut_blocks(blocks, i0, i1):
                 post.append(b)
     return pre, mid, post
 
-class Line:
-    def __init__(self, s=None, i=None):
-        self._text = s
-        self._edit = None
-        self._line_number = i
-
-    def __repr__(self):
-        return '<Edit line_number=%d, text=%s, edit=%s/>' % (self._line_number, repr(self._text), repr(self._edit))
+# cut the blocks of the tree 'blocks' spanning rows [i0, i1), returns the
+# index of the first spanned block, the spanned blocks, and the spanned
+# blocks cut into the parts before, inside, and after the rows
+def _cut_block_span(blocks, i0, i1):
+    bi0, bs0 = blocks.find(i0)
+    bi1, bs1 = blocks.find(i1)
+    if bs1 < i1:
+        bi1 += 1
+    span = list(blocks.slice(bi0, bi1))
+    pre, mid, post = _cut_blocks(span, i0 - bs0, i1 - bs0)
+    return bi0, span, pre, mid, post
+
+# yield the items of 'lines' while appending their hashes to 'hashes'
+def _hash_lines(lines, hashes):
+    append = hashes.append
+    for s in lines:
+        append(hash(s))
+        yield s
+
+# number of leading items that are equal in the arrays 'a' and 'b'
+def _common_prefix(a, b):
+    lo, hi = 0, min(len(a), len(b))
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[lo:mid] == b[lo:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+# number of leading and trailing rows that are the same in the LineStores
+# 'pre' and 'post'
+def _common_rows(pre, post):
+    rows_a, rows_b, flags_a, flags_b = pre.get_rows(), post.get_rows(), pre.get_spacers(), post.get_spacers()
+    n = min(_common_prefix(rows_a, rows_b), _common_prefix(flags_a, flags_b))
+    m = min(_common_prefix(rows_a[n:][::-1], rows_b[n:][::-1]), _common_prefix(flags_a[n:][::-1], flags_b[n:][::-1]))
+    return n, m
+
+# combine the change replacing 'pre_a' at 'i_a' with 'post_a' and the
+# following change replacing 'pre_b' at 'i_b' with 'post_b', returns the
+# combined (i, pre, post) or None unless the second change replaces exactly
+# the items written by the first
+def _merge_deltas(i_a, pre_a, post_a, i_b, pre_b, post_b):
+    if not pre_b and not post_b:
+        return i_a, pre_a, post_a
+    if not pre_a and not post_a:
+        return i_b, pre_b, post_b
+    if i_a == i_b and len(post_a) == len(pre_b):
+        return i_a, pre_a, post_b
+    return None
+
+# concatenation of LineStores sharing a pool
+def _join_stores(stores):
+    parts = [ store for store in stores if len(store) > 0 ]
+    if len(parts) == 1:
+        return parts[0]
+    result = stores[0].new_store()
+    for store in parts:
+        result.extend(store)
+    return result
+
+# combine the consecutive (i, pre, post) changes 'a' and 'b' of a pane's
+# contents into one if the rows replaced by 'b' overlap or touch the rows
+# written by 'a', returns None otherwise
+def _merge_changes(a, b):
+    i_a, pre_a, post_a = a
+    i_b, pre_b, post_b = b
+    end_a, end_b = i_a + len(post_a), i_b + len(pre_b)
+    if i_b > end_a or end_b < i_a:
+        return None
+    # rows of 'pre_b' outside the rows written by 'a' were not changed by it
+    pre = _join_stores([ pre_b.slice(0, max(i_a - i_b, 0)), pre_a, pre_b.slice(min(max(end_a - i_b, 0), len(pre_b)), len(pre_b)) ])
+    post = _join_stores([ post_a.slice(0, max(i_b - i_a, 0)), post_b, post_a.slice(min(max(end_b - i_a, 0), len(post_a)), len(post_a)) ])
+    return min(i_a, i_b), pre, post
+
+# boolean array flagging the spacer rows of 'contents'
+def _np_spacers(contents):
+    if isinstance(contents, diffuse.linestore.LineStore):
+        return numpy.frombuffer(contents.get_spacers(), dtype=numpy.bool_)
+    return numpy.fromiter((c is None for c in contents), numpy.bool_, len(contents))
+
+# slice of 'contents' that shares rows when 'contents' is a LineStore
+def _np_slice(contents, i, j):
+    if isinstance(contents, diffuse.linestore.LineStore):
+        return contents.slice(i, j)
+    return contents[i:j]
+
+# empty sequence of the same kind as 'contents'
+def _np_new(contents):
+    if isinstance(contents, diffuse.linestore.LineStore):
+        return contents.new_store()
+    return []
+
+# lengths of the blocks between the sorted cut positions in 'cuts'
+def _np_blocks(cuts, n):
+    cuts = numpy.unique(numpy.concatenate(([ 0, n ], cuts)))
+    return numpy.diff(cuts[cuts <= n]).tolist()
+
+# copy each of 'contents_list' inserting 'pads[k]' spacers at row 'ends[k]'
+def _np_pad(contents_list, ends, pads):
+    idx = numpy.flatnonzero(pads > 0)
+    cuts = list(zip(ends[idx].tolist(), pads[idx].tolist()))
+    new_contents = []
+    for contents in contents_list:
+        c, start = _np_new(contents), 0
+        for end, n in cuts:
+            c.extend(_np_slice(contents, start, end))
+            c.extend(n * [ None ])
+            start = end
+        c.extend(_np_slice(contents, start, len(contents)))
+        new_contents.append(c)
+    return new_contents
+
+# vectorised version of FileCompare._remove_null_rows()
+def _np_remove_null_rows(contents_list, blocks):
+    keep = ~_np_spacers(contents_list[0])
+    for contents in contents_list[1:]:
+        keep |= ~_np_spacers(contents)
+    # copy the runs of kept rows
+    d = numpy.diff(keep.astype(numpy.int8), prepend=0, append=0)
+    runs = list(zip(numpy.flatnonzero(d > 0).tolist(), numpy.flatnonzero(d < 0).tolist()))
+    new_contents = []
+    for contents in contents_list:
+        c = _np_new(contents)
+        for start, end in runs:
+            c.extend(_np_slice(contents, start, end))
+        new_contents.append(c)
+    # each block keeps the number of its rows that were kept
+    kept = numpy.concatenate(([ 0 ], numpy.cumsum(keep)))
+    ends = numpy.cumsum(numpy.array(blocks, dtype=numpy.int64))
+    counts = numpy.diff(kept[numpy.concatenate(([ 0 ], ends))])
+    return new_contents, counts[counts > 0].tolist()
+
+# vectorised version of the walk in FileCompare._auto_align()
+def _np_auto_align(contents_left, contents_right, b_left, b_right, matches):
+    m = numpy.array(matches, dtype=numpy.int64).reshape(-1, 3)
+    # every matched line ends a segment
+    reps = m[:, 2] + 1
+    offsets = numpy.arange(int(reps.sum())) - numpy.repeat(numpy.cumsum(reps) - reps, reps)
+    segments = []
+    for contents, goals in (contents_left[-1], m[:, 0]), (contents_right[0], m[:, 1]):
+        # a segment ends before the next line after 'goal' lines
+        lines = numpy.flatnonzero(~_np_spacers(contents))
+        ends = numpy.append(lines, len(contents))[numpy.repeat(goals, reps) + offsets]
+        starts = numpy.concatenate(([ 0 ], ends[:-1]))
+        segments.append((starts, ends))
+    (starts_left, ends_left), (starts_right, ends_right) = segments
+    delta_left, delta_right = ends_left - starts_left, ends_right - starts_right
+    n = numpy.maximum(delta_left, delta_right)
+    out_ends = numpy.cumsum(n)
+    out_starts = out_ends - n
+
+    # pad the shorter side of each segment with spacers
+    new_contents = _np_pad(contents_left, ends_left, delta_right - delta_left)
+    new_contents.extend(_np_pad(contents_right, ends_right, delta_left - delta_right))
+
+    # block boundaries on either side cut the aligned rows
+    cuts = []
+    for blocks, starts, ends in (b_left, starts_left, ends_left), (b_right, starts_right, ends_right):
+        bounds = numpy.cumsum(numpy.array([ 0 ] + blocks[:-1], dtype=numpy.int64))
+        k = numpy.searchsorted(ends, bounds, side='right')
+        valid = k < len(ends)
+        k = k[valid]
+        cuts.append(out_starts[k] + bounds[valid] - starts[k])
+    total = int(out_ends[-1]) if len(out_ends) else 0
+    return new_contents, _np_blocks(numpy.concatenate(cuts), total)
 
 class File:
     def __init__(self, undo_manager, nlines):
@@ -88,6 +242,8 @@ class File:
         self._name = None
         # name of codec used to translate the file contents to unicode text
         self._encoding = None
+        # number of DOS, Mac, and Unix line endings in the file
+        self._line_endings = None
         # the VCS object
         self._vcs = None
         # revision used to retrieve file from the VCS
@@ -100,6 +256,13 @@ class File:
         # most recent 'stat' for files read from disk -- used on focus
         # change to warn about changes to file on disk
         self._last_stat = None
+        # hash of each line and CRC-32 of the end of the file as last read
+        # from disk -- used to reload only the lines that changed
+        self._line_hashes = None
+        self._chunk_crcs = None
+        # digest of the lines for each content ID whose lines are known to
+        # be those of a file in order -- used to key the diff cache
+        self._digests = { 0: b'' }
 
         # we assign a unique ID after every destructive change
         self._content_id = 0
@@ -108,11 +271,15 @@ class File:
         # next unique content ID
         self._next_content_id = 1
 
-        self._contents = nlines * [ None ]
+        # rows of the pane, None is used for spacer rows
+        self._contents = diffuse.linestore.LineStore(nlines * [ None ])
 
+        # changes to the contents made in one undo block are reported at once
         self._signals = sigs = {}
-        for name in 'file-info-changed', 'contents-changed':
-            sigs[name] = diffuse.signal.Signal()
+        sigs['file-info-changed'] = diffuse.signal.Signal()
+        sigs['contents-changed'] = diffuse.signal.Signal(_merge_changes)
+        for sig in sigs.values():
+            undo_manager.add_signal(sig)
 
         # FIXME: where should these live?
         #self._annotation_author = None
@@ -122,26 +289,65 @@ class File:
     def __repr__(self):
         return '<File name=%s, encoding=%s, revision=%s contents=%s/>' % (repr(self._name), repr(self._encoding), repr(self._revision), repr(self._contents))
 
+    def add_callback(self, name, cb, data=None):
+        return self._signals[name].add_callback(cb, data)
+
+    def get_encoding(self):
+        return self._encoding
+
+    def get_line_endings(self):
+        return self._line_endings
+
     class FileInfoAction:
-        def __init__(self, f, pre_name, post_name, pre_encoding, post_encoding):
-            self._data = f, pre_name, post_name, pre_encoding, post_encoding
+        def __init__(self, f, pre_name, post_name, pre_encoding, post_encoding, pre_line_endings, post_line_endings):
+            self._data = f, pre_name, post_name, pre_encoding, post_encoding, pre_line_endings, post_line_endings
         def redo(self):
-            f, pre_name, post_name, pre_encoding, post_encoding = self._data
-            f._file_info_changed(post_name, post_encoding)
+            f, pre_name, post_name, pre_encoding, post_encoding, pre_line_endings, post_line_endings = self._data
+            f._file_info_changed(post_name, post_encoding, post_line_endings)
         def undo(self):
-            f, pre_name, post_name, pre_encoding, post_encoding = self._data
-            f._file_info_changed(pre_name, pre_encoding)
-
-    def _file_info_changed(self, name, encoding):
+            f, pre_name, post_name, pre_encoding, post_encoding, pre_line_endings, post_line_endings = self._data
+            f._file_info_changed(pre_name, pre_encoding, pre_line_endings)
+        def merge(self, other):
+            f, pre_name, post_name, pre_encoding, post_encoding, pre_line_endings, post_line_endings = self._data
+            if type(other) is not type(self) or other._data[0] is not f:
+                return None
+            f, other_pre_name, post_name, other_pre_encoding, post_encoding, other_pre_line_endings, post_line_endings = other._data
+            return File.FileInfoAction(f, pre_name, post_name, pre_encoding, post_encoding, pre_line_endings, post_line_endings)
+
+    def _file_info_changed(self, name, encoding, line_endings):
         self._name = name
         self._encoding = encoding
+        self._line_endings = line_endings
         self._signals['file-info-changed'].emit()
 
-    def set_file_info(self, name, encoding, stat, content_id):
+    def set_file_info(self, name, encoding, stat, content_id, line_endings=None):
         self._stat = stat
         self._last_stat = stat
         self._saved_content_id = content_id
-        self._undo_manager.apply(self.FileInfoAction(self, self._name, name, self._encoding, encoding))
+        self._undo_manager.apply(self.FileInfoAction(self, self._name, name, self._encoding, encoding, self._line_endings, line_endings))
+
+    class ReloadInfoAction:
+        def __init__(self, f, pre, post):
+            self._data = f, pre, post
+        def redo(self):
+            f, pre, post = self._data
+            f._line_hashes, f._chunk_crcs = post
+        def undo(self):
+            f, pre, post = self._data
+            f._line_hashes, f._chunk_crcs = pre
+        def get_size(self):
+            f, pre, post = self._data
+            return diffuse.undo.ACTION_SIZE + sum([ 8 * (len(hashes) + len(crcs)) for hashes, crcs in (pre, post) if hashes is not None ])
+        def merge(self, other):
+            f, pre, post = self._data
+            if type(other) is not type(self) or other._data[0] is not f:
+                return None
+            return File.ReloadInfoAction(f, pre, other._data[2])
+
+    # 'line_hashes' and 'chunk_crcs' must not be modified afterwards as undo
+    # records share them
+    def set_reload_info(self, line_hashes, chunk_crcs):
+        self._undo_manager.apply(self.ReloadInfoAction(self, (self._line_hashes, self._chunk_crcs), (line_hashes, chunk_crcs)))
 
     class ContentsAction:
         def __init__(self, f, i, pre, post, pre_content_id, post_content_id):
@@ -152,6 +358,26 @@ class File:
         def undo(self):
             f, i, pre, post, pre_content_id, post_content_id = self._data
             f._contents_changed(i, post, pre, pre_content_id)
+        def get_size(self):
+            f, i, pre, post, pre_content_id, post_content_id = self._data
+            # an encoded row and a spacer flag for each row, buffers whose
+            # lines were all removed, eg. by a reload, are only kept by the
+            # history so their text is counted too
+            kept = set([ id(buffer) for buffer, n in post.get_buffer_counts() ])
+            return diffuse.undo.ACTION_SIZE + 9 * (len(pre) + len(post)) + sum([ buffer.get_size() for buffer, n in pre.get_buffer_counts() if n == len(buffer) and id(buffer) not in kept ])
+        # consecutive edits of the same single line merge
+        def merge(self, other):
+            f, i, pre, post, pre_content_id, post_content_id = self._data
+            if type(other) is not type(self) or other._data[0] is not f:
+                return None
+            f, other_i, other_pre, other_post, other_pre_content_id, post_content_id = other._data
+            if max(len(pre), len(post), len(other_pre), len(other_post)) > 1:
+                return None
+            delta = _merge_deltas(i, pre, post, other_i, other_pre, other_post)
+            if delta is None:
+                return None
+            i, pre, post = delta
+            return File.ContentsAction(f, i, pre, post, pre_content_id, post_content_id)
 
     def _contents_changed(self, i, pre, post, content_id):
         self._contents[i:i + len(pre)] = post
@@ -161,7 +387,10 @@ class File:
     def set_contents(self, i1, i2, post):
         post_content_id = self._next_content_id
         self._next_content_id += 1
-        self._undo_manager.apply(self.ContentsAction(self, i1, self._contents[i1:i2], post, self._content_id, post_content_id))
+        pre, post = self._contents.slice(i1, i2), self._contents.new_store(post)
+        # only the rows that change are recorded
+        n, m = _common_rows(pre, post)
+        self._undo_manager.apply(self.ContentsAction(self, i1 + n, pre.slice(n, len(pre) - m), post.slice(n, len(post) - m), self._content_id, post_content_id))
 
 # FIXME: this can be greatly improved upon
 # merge pane will have a map from lines to the conflict to which it belongs
@@ -185,13 +414,40 @@ class FileCompare:
     def __init__(self, n):
         self._undo_manager = diffuse.undo.UndoManager()
         self._panes = [ File(self._undo_manager, 0) for i in range(n) ]
-        self._blocks = []
+        # lengths of the blocks of rows aligned as a unit, the running sum is
+        # indexed so the block containing a row can be found in O(log n)
+        self._blocks = diffuse.rope.Rope(array.array('q'), None, True)
+        # interned line tokens shared by all alignments of these panes
+        self._tokenizer = diffuse.diff.Tokenizer()
+        # name of the diff engine used for alignment
+        self._diff_engine = 'patience'
+        # extra keyword arguments for the diff engine, eg. an executor to
+        # enable parallel diffs with the patience engine
+        self._diff_options = {}
+        # optional time limit in seconds for each diff
+        self._diff_timeout = None
+        # true if any diff of the last alignment had to be approximated
+        self._approximate = False
+        # files of at least this many bytes are memory-mapped and read
+        # through a line index instead of decoding every line, None
+        # disables this
+        self._huge_file_size = _HUGE_FILE_SIZE
+        # directory used to cache line indices or None
+        self._index_cache_dir = None
+        # true if lines are compared using keys instead of their text
+        self._use_keys = False
+        # optional diffuse.diffcache.DiffCache of alignments
+        self._diff_cache = None
+        # optional threading.Event set to cut alignment short, the results
+        # are then only approximate
+        self._cancel_event = None
         self._signals = sigs = {}
         for name in ('panes_changed', ): #'blocks_changed'
             sigs[name] = diffuse.signal.Signal()
+            self._undo_manager.add_signal(sigs[name])
 
     def __repr__(self):
-        return '<FileCompare undo_manager=%s, panes=%s, blocks=%s, signals=%s/>' % (self._undo_manager, self._panes, self._blocks, self._signals)
+        return '<FileCompare undo_manager=%s, panes=%s, blocks=%s, signals=%s/>' % (self._undo_manager, self._panes, list(self._blocks), self._signals)
 
     def n_panes(self):
         return len(self._panes)
@@ -199,9 +455,86 @@ class FileCompare:
     def get_n_lines(self):
         return len(self._panes[0]._contents)
 
+    def get_file(self, p):
+        return self._panes[p]
+
     def enable_undos(self):
         self._undo_manager.enable()
 
+    # optional diffuse.undo.Journal holding undo blocks that do not fit in
+    # memory
+    def set_undo_journal(self, journal):
+        self._undo_manager.set_journal(journal)
+
+    def get_diff_engine(self):
+        return self._diff_engine
+
+    def set_diff_engine(self, name, **options):
+        # raises KeyError for unknown engines
+        diffuse.diff.get_engine(name)
+        self._diff_engine = name
+        self._diff_options = options
+
+    def set_diff_timeout(self, timeout):
+        self._diff_timeout = timeout
+
+    def is_approximate(self):
+        return self._approximate
+
+    def set_huge_file_mode(self, size, cache_dir=None):
+        self._huge_file_size = size
+        self._index_cache_dir = cache_dir
+
+    def set_diff_cache(self, cache):
+        self._diff_cache = cache
+
+    def set_cancel_event(self, event):
+        self._cancel_event = event
+
+    def is_cancelled(self):
+        return self._cancel_event is not None and self._cancel_event.is_set()
+
+    # key for the result of loading lines with digest 'digest' into pane
+    # 'p' given the current state of every pane, None if the lines of a pane
+    # are not known
+    def _get_cache_key(self, p, digest, isreload):
+        h = hashlib.blake2b()
+        def add(b):
+            h.update(len(b).to_bytes(8, 'little'))
+            h.update(b)
+        options = sorted([ (k, v) for k, v in self._diff_options.items() if isinstance(v, (bool, int, float, str)) ])
+        add(repr((_DIFF_CACHE_VERSION, self._diff_engine, options, self._use_keys, len(self._panes), p, isreload)).encode('utf-8'))
+        for pane in self._panes:
+            d = pane._digests.get(pane._content_id)
+            if d is None:
+                return None
+            add(d)
+            add(pane._contents.get_spacers())
+        add(self._blocks.flatten().tobytes())
+        add(digest)
+        return h.digest()
+
+    # the new contents of each pane and the new blocks from the diff cache
+    # or None if the cached alignment does not fit, 'buffer' holds the lines
+    # of 'post' when they were all read from one file
+    def _get_cached_alignment(self, key, p, post, buffer=None):
+        result = self._diff_cache.get(key)
+        if result is None:
+            return None
+        blocks, spacers = result
+        if len(spacers) != len(self._panes) or any(len(flags) != sum(blocks) for flags in spacers):
+            return None
+        new_contents = []
+        for q, (pane, flags) in enumerate(zip(self._panes, spacers)):
+            contents = pane._contents
+            if q == p:
+                contents = contents.new_store(post) if buffer is None else contents.new_buffer_store(buffer)
+            contents = contents.relayout(flags)
+            if contents is None:
+                return None
+            new_contents.append(contents)
+        return new_contents, list(blocks)
+
     class PaneAction:
         def __init__(self, fc, p, pre, post):
             self._data = fc, p, pre, post
@@ -211,13 +544,18 @@ class FileCompare:
         def undo(self):
             fc, p, pre, post = self._data
             fc._panes_changed(p, post, pre)
+        def get_size(self):
+            fc, p, pre, post = self._data
+            # the buffers of removed panes are only kept by the history
+            n = sum([ buffer.get_size() for f in pre if f not in fc._panes for buffer in f._contents.get_buffers() ])
+            return diffuse.undo.ACTION_SIZE + sum([ 9 * len(f._contents) for f in pre + post ]) + n
 
     def _panes_changed(self, p, pre, post):
         self._panes[p:p + len(pre)] = post
         self._signals['panes_changed'].emit((p, pre, post))
 
     def insert_pane(self, p):
-        self._undo_manager.apply(self.PaneAction(self, p, [], [ File(self._undo_manager, sum(self._blocks)) ]))
+        self._undo_manager.apply(self.PaneAction(self, p, [], [ File(self._undo_manager, self._blocks.total()) ]))
 
     def _remove_pane(self, p):
         # NB: caller should remove un-needed rows
@@ -231,15 +569,36 @@ class FileCompare:
 
     class BlockAction:
         def __init__(self, blocks, i, pre, post):
-            self._data = blocks, i, pre, post
+            pre, post = array.array('q', pre), array.array('q', post)
+            # only the blocks that change are recorded
+            n = _common_prefix(pre, post)
+            m = _common_prefix(pre[n:][::-1], post[n:][::-1])
+            self._data = blocks, i + n, pre[n:len(pre) - m], post[n:len(post) - m]
         def redo(self):
             blocks, i, pre, post = self._data
             blocks[i:i + len(pre)] = post
         def undo(self):
             blocks, i, pre, post = self._data
             blocks[i:i + len(post)] = pre
+        def get_size(self):
+            blocks, i, pre, post = self._data
+            return diffuse.undo.ACTION_SIZE + 8 * (len(pre) + len(post))
+        def merge(self, other):
+            blocks, i, pre, post = self._data
+            if type(other) is not type(self) or other._data[0] is not blocks:
+                return None
+            delta = _merge_deltas(i, pre, post, *other._data[1:])
+            if delta is None:
+                return None
+            result = FileCompare.BlockAction(blocks, 0, [], [])
+            result._data = (blocks, ) + delta
+            return result
 
     def _remove_null_rows(self, contents_list, blocks):
+        if numpy is not None and len(contents_list[0]) >= _NUMPY_MIN_ROWS:
+            return _np_remove_null_rows(contents_list, blocks)
+        # index plain lists rather than ropes
+        contents_list = [ list(c) for c in contents_list ]
         new_contents, new_blocks, n, bi, bs, processed  = [ [] for c in contents_list ], [], len(contents_list[0]), -1, 0, 0
         na, pairing = new_blocks.append, list(zip(contents_list, [ c.append for c in new_contents ]))
         for i in range(n):
@@ -250,7 +609,7 @@ class FileCompare:
                     break
             else:
                 # found a row that needs removal
-                while bs < i:
+                while bs <= i:
                     delta = bs - processed
                     if delta:
                         na(delta)
@@ -258,9 +617,6 @@ class FileCompare:
                     bi += 1
                     bs += blocks[bi]
                 # process removed line
-                if bs <= i:
-                    bi += 1
-                    bs += blocks[bi]
                 processed += 1
         while bs < n:
             delta = bs - processed
@@ -274,22 +630,74 @@ class FileCompare:
         return new_contents, new_blocks
 
     def get_string(self, p, i):
-        e = self._panes[p]._contents[i]
-        if e is not None:
-            if e._edit is not None:
-                return e._edit
-            if e._text is not None:
-                return e._text
-        return ''
+        return self._panes[p]._contents.get_string(i)
+
+    # strings of all of a pane's rows in order, None for spacers
+    def get_strings(self, p):
+        gcs = self._get_compare_string
+        for e in self._panes[p]._contents:
+            yield None if e is None else gcs(e)
 
     def _get_compare_string(self, e):
-        if e._edit is not None:
-            return e._edit
-        if e._text is not None:
-            return e._text
-        return ''
+        s = e._edit
+        if s is None:
+            s = e._text
+            if s is None:
+                return ''
+        return s
+
+    # key of the compare string, taken from the buffer when possible so
+    # lines of huge files are not decoded
+    def _get_compare_key(self, e):
+        s = e._edit
+        if s is None:
+            if isinstance(e, diffuse.linestore.BufferLine):
+                return e._buffer.get_key(e._index)
+            s = e._text
+            if s is None:
+                s = ''
+        return diffuse.linestore.line_key(s)
+
+    # compare strings, or their keys for huge files, of the lines of a
+    # LineStore or list skipping spacers, keys of a LineStore are taken from
+    # its buffers without making an object for each line
+    def _get_compare_values(self, contents):
+        if not self._use_keys:
+            gcs = self._get_compare_string
+        elif isinstance(contents, diffuse.linestore.LineStore):
+            return contents.get_keys()
+        else:
+            gcs = self._get_compare_key
+        return [ gcs(c) for c in contents if c ]
+
+    # diff the compare strings of the lines of two LineStores or lists
+    def _diff(self, a, b):
+        # the table is reused by later alignments and reloads, it is dropped
+        # once it holds many more lines than could be shown so lines that
+        # are no longer shown are not held forever
+        tokenizer = self._tokenizer
+        if tokenizer.size() > _TOKENIZER_GROWTH * (len(self._panes) * self.get_n_lines() + len(a) + len(b)):
+            tokenizer.clear()
+        tokenize = tokenizer.tokenize
+        engine = diffuse.diff.get_engine(self._diff_engine)
+        budget = diffuse.diff.Budget(timeout=self._diff_timeout, cancel_event=self._cancel_event)
+        matches = engine(tokenize(self._get_compare_values(a)), tokenize(self._get_compare_values(b)), budget, **self._diff_options)
+        self._approximate = self._approximate or budget.is_approximate()
+        return matches
 
     def _auto_align(self, contents_left, contents_right, b_left, b_right):
+        vectorise = numpy is not None and len(contents_left[-1]) + len(contents_right[0]) >= _NUMPY_MIN_ROWS
+        if not vectorise:
+            # index plain lists rather than ropes
+            contents_left = [ list(c) for c in contents_left ]
+            contents_right = [ list(c) for c in contents_right ]
+
+        c_left = contents_left[-1]
+        c_right = contents_right[0]
+        matches = self._diff(c_left, c_right)
+        if vectorise:
+            return _np_auto_align(contents_left, contents_right, b_left, b_right, matches)
+
         # FIXME: it may be faster to rebuild everything
         new_contents_left = [ [] for c in contents_left ]
         new_contents_right = [ [] for c in contents_right ]
@@ -302,11 +710,7 @@ class FileCompare:
 
         idx_left, idx_right, count_left, count_right, bi_left, bi_right, bs_left, bs_right, nprocessed = 0, 0, 0, 0, -1, -1, 0, 0, 0
 
-        c_left = contents_left[-1]
-        c_right = contents_right[0]
-        gcs = self._get_compare_string
-
-        for i_left, i_right, n in diffuse.diff.patience_diff([ gcs(c) for c in c_left if c ], [ gcs(c) for c in c_right if c ]):
+        for i_left, i_right, n in matches:
             for i in range(n + 1):
                 # process matching lines
                 goal = i_left + i
@@ -356,13 +760,17 @@ class FileCompare:
                     if delta_left and n > bs_left - start_left:
                         cut = True
                         n = bs_left - start_left
-                        bi_left += 1
-                        bs_left += b_left[bi_left]
                     if delta_right and n > bs_right - start_right:
                         cut = True
                         n = bs_right - start_right
-                        bi_right += 1
-                        bs_right += b_right[bi_right]
+                    if cut:
+                        # step past the blocks ending at the cut
+                        if delta_left and n == bs_left - start_left:
+                            bi_left += 1
+                            bs_left += b_left[bi_left]
+                        if delta_right and n == bs_right - start_right:
+                            bi_right += 1
+                            bs_right += b_right[bi_right]
 
                     nprocessed += n
                     if cut:
@@ -401,25 +809,18 @@ class FileCompare:
         return c_mid, b_mid
 
     def _manual_align(self, p, i0_left, i1_left, i0_right, i1_right):
-        start, end, b_pre, b_mid, b_post, i = min(i0_left, i0_right), max(i1_left, i1_right), [], [], [], 0
-        for b in self._blocks:
-            if i + b <= start:
-                b_pre.append(b)
-            elif i < end:
-                b_mid.append(b)
-            else:
-                b_post.append(b)
-            i += b
+        start, end = min(i0_left, i0_right), max(i1_left, i1_right)
+        bi, blocks, b_pre, b_mid, b_post = _cut_block_span(self._blocks, start, end)
 
+        p_left, p_right = self._panes[:p + 1], self._panes[p + 1:]
         if len(p_left) == 1:
             b0_left, b1_left, b2_left = _make_block(i0_left - start), _make_block(i1_left - i0_left), _make_block(end - i1_left)
         else:
             b0_left, b1_left, b2_left = _cut_blocks(b_mid, i0_left - start, i1_left - start)
 
-        p_left, p_right = self._panes[:p + 1], self._panes[p + 1:]
-        c0_left = [ pane._contents[start:i0_left] for pane in p_left ]
-        c1_left = [ pane._contents[i0_left:i1_left] for pane in p_left ]
-        c2_left = [ pane._contents[i1_left:end] for pane in p_left ]
+        c0_left = [ pane._contents.slice(start, i0_left) for pane in p_left ]
+        c1_left = [ pane._contents.slice(i0_left, i1_left) for pane in p_left ]
+        c2_left = [ pane._contents.slice(i1_left, end) for pane in p_left ]
         c0_left, b0_left = self._remove_null_rows(c0_left, b0_left)
         c1_left, b1_left = self._remove_null_rows(c1_left, b1_left)
         c2_left, b2_left = self._remove_null_rows(c2_left, b2_left)
@@ -429,9 +830,9 @@ class FileCompare:
         else:
             b0_right, b1_right, b2_right = _cut_blocks(b_mid, i0_right - start, i1_right - start)
 
-        c0_right = [ pane._contents[start:i0_right] for pane in p_right ]
-        c1_right = [ pane._contents[i0_right:i1_right] for pane in p_right ]
-        c2_right = [ pane._contents[i1_right:end] for pane in p_right ]
+        c0_right = [ pane._contents.slice(start, i0_right) for pane in p_right ]
+        c1_right = [ pane._contents.slice(i0_right, i1_right) for pane in p_right ]
+        c2_right = [ pane._contents.slice(i1_right, end) for pane in p_right ]
         c0_right, b0_right = self._remove_null_rows(c0_right, b0_right)
         c1_right, b1_right = self._remove_null_rows(c1_right, b1_right)
         c2_right, b2_right = self._remove_null_rows(c2_right, b2_right)
@@ -443,58 +844,236 @@ class FileCompare:
         for a, b, c in zip(c0, c1, c2):
             a.extend(b)
             a.extend(c)
-        b0.extend(b1)
-        b0.extend(b2)
+        b_pre.extend(b0)
+        b_pre.extend(b1)
+        b_pre.extend(b2)
+        b_pre.extend(b_post)
 
         for pane, contents in zip(self._panes, c0):
             pane.set_contents(start, end, contents)
 
-        npre = len(b_pre)
-        self._undo_manager.apply(self.BlockAction(self._blocks, npre, npre + len(b_mid), b0))
+        self._undo_manager.apply(self.BlockAction(self._blocks, bi, blocks, b_pre))
+
+    # true if row 'i' holds the same line in every pane
+    def _is_anchor(self, i):
+        s = None
+        for pane in self._panes:
+            contents = pane._contents
+            if contents.is_spacer(i):
+                return False
+            t = contents.get_string(i)
+            if s is None:
+                s = t
+            elif s != t:
+                return False
+        return True
+
+    # grow rows [i0, i1) to the nearest anchor rows on each side, an edit
+    # can only change the alignment of rows between the anchors, the window
+    # never crosses a block boundary so manual alignments are kept
+    def _find_window(self, i0, i1):
+        blocks, limit = self._blocks, _ANCHOR_SEARCH_LIMIT
+        bi, lo = blocks.find(i0)
+        bi, hi = blocks.find(max(i1 - 1, i0))
+        if bi < len(blocks):
+            hi += blocks[bi]
+        w0 = i0
+        while w0 > lo and i0 - w0 < limit and not self._is_anchor(w0 - 1):
+            w0 -= 1
+        w1 = i1
+        while w1 < hi and w1 - i1 < limit and not self._is_anchor(w1):
+            w1 += 1
+        return w0, w1
 
     def _replace_contents(self, p, i0, i1, contents):
-        b_pre, blocks, b_post = _cut_blocks(self._blocks, i0, i1)
-        c_mid, b_mid = [ contents ], _make_block(len(contents))
+        self._approximate = False
+        # only the window around the edit is re-aligned
+        w0, w1 = self._find_window(i0, i1)
+        pane_contents = self._panes[p]._contents
+        new_contents = [ c for c in pane_contents.slice(w0, i0) if c ]
+        new_contents.extend(contents)
+        new_contents.extend(c for c in pane_contents.slice(i1, w1) if c)
+
+        bi, b_span, b_pre, blocks, b_post = _cut_block_span(self._blocks, w0, w1)
+        c_mid, b_mid = [ new_contents ], _make_block(len(new_contents))
 
         p_left, p_mid, p_right = self._panes[:p], [ self._panes[p] ], self._panes[p + 1:]
 
-        c_left = [ pane._contents[i0:i1] for pane in p_left ]
-        c_right = [ pane._contents[i0:i1] for pane in p_right ]
+        c_left = [ pane._contents.slice(w0, w1) for pane in p_left ]
+        c_right = [ pane._contents.slice(w0, w1) for pane in p_right ]
 
         c_mid, b_mid = self._auto_align3(c_left, c_mid, c_right, blocks, b_mid, blocks)
         for pane, contents in zip(self._panes, c_mid):
-            pane.set_contents(i0, i1, contents)
+            pane.set_contents(w0, w1, contents)
+        # the pane's lines no longer match the file on disk
+        self._panes[p].set_reload_info(None, None)
 
         b_pre.extend(b_mid)
         b_pre.extend(b_post)
-        self._undo_manager.apply(self.BlockAction(self._blocks, 0, self._blocks[:], b_pre))
+        self._undo_manager.apply(self.BlockAction(self._blocks, bi, b_span, b_pre))
+
+    # reload pane 'p' re-diffing only the lines that changed on disk, returns
+    # False if the whole file needs to be reloaded
+    def _reload_file(self, p, name, encodings):
+        pane = self._panes[p]
+        hashes, encoding, old_stat = pane._line_hashes, pane._encoding, pane._stat
+        if hashes is None or name != pane._name or encoding not in encodings or pane._contents.has_edits():
+            return False
+        # lines can only be read from an offset if a line ending is one byte
+        if '\n'.encode(encoding) != b'\n':
+            return False
+        stat = os.stat(name)
+        if (stat.st_dev, stat.st_ino) != (old_stat.st_dev, old_stat.st_ino):
+            return False
+
+        contents, n, old_size = pane._contents, len(hashes), old_stat.st_size
+        line_endings = [ 0, 0, 0 ]
+        try:
+            if n > 0 and stat.st_size > old_size and diffuse.reader.chunk_checksums(name, 0, old_size, _RELOAD_CHUNK_SIZE) == pane._chunk_crcs:
+                # the file grew and all of its old bytes are unchanged so it
+                # was appended to, re-read from the start of the last line as
+                # it may have been extended
+                head, tail = n - 1, 0
+                old_last = contents.get_string(contents.find_line(head))
+                lines = list(diffuse.reader.read_lines(name, encoding, old_size - len(old_last.encode(encoding)), line_endings))
+                if not lines or not lines[0].startswith(old_last):
+                    return False
+                # update the old counts for the re-read line
+                old_line_endings = [ 0, 0, 0 ]
+                diffuse.reader.count_line_endings(old_last, old_line_endings)
+                line_endings = [ a + b - c for a, b, c in zip(pane._line_endings, line_endings, old_line_endings) ]
+                hashes = hashes[:head]
+                hashes.extend(map(hash, lines))
+                # only the appended bytes and the partial last chunk before
+                # them need checksums
+                k = old_size // _RELOAD_CHUNK_SIZE
+                crcs = pane._chunk_crcs[:k]
+                crcs.extend(diffuse.reader.chunk_checksums(name, k * _RELOAD_CHUNK_SIZE, stat.st_size, _RELOAD_CHUNK_SIZE))
+            else:
+                # find the unchanged head and tail of the file
+                lines = list(diffuse.reader.read_lines(name, encoding, 0, line_endings))
+                hashes = array.array('q', map(hash, lines))
+                head = _common_prefix(pane._line_hashes, hashes)
+                tail = _common_prefix(pane._line_hashes[head:][::-1], hashes[head:][::-1])
+                del lines[:head]
+                crcs = diffuse.reader.chunk_checksums(name, 0, stat.st_size, _RELOAD_CHUNK_SIZE)
+        except UnicodeDecodeError:
+            return False
+
+        # the tail is re-numbered and the lines in between are re-aligned
+        new_lines = diffuse.linestore.TextBuffer(lines, head).get_lines()
+        n_mid, n_rows = len(new_lines) - tail, len(contents)
+        r0 = contents.find_line(head - 1) + 1 if head > 0 else 0
+        r1 = contents.find_line(n - tail) if tail > 0 else n_rows
+        if tail > 0:
+            it = iter(new_lines[n_mid:])
+            pane.set_contents(r1, n_rows, [ None if spacer else next(it) for spacer in contents.slice(r1, n_rows).get_spacers() ])
+        if n_mid > 0 or r0 < r1:
+            self._replace_contents(p, r0, r1, new_lines[:n_mid])
+
+        pane.set_reload_info(hashes, crcs)
+        pane.set_file_info(name, encoding, stat, pane._content_id, tuple(line_endings))
+        return True
+
+    # release the memory maps of the huge files shown in pane 'p', they are
+    # mapped again if their lines are read
+    def _close_buffers(self, p):
+        for buffer in self._panes[p]._contents.get_buffers():
+            close = getattr(buffer, 'close', None)
+            if close is not None:
+                close()
+
+    # true if pane 'p' shows lines of a huge file
+    def _is_huge(self, p):
+        return any(isinstance(buffer, diffuse.lineindex.MappedBuffer) for buffer in self._panes[p]._contents.get_buffers())
+
+    # release the memory maps of every pane
+    def close(self):
+        for p in range(len(self._panes)):
+            self._close_buffers(p)
 
     # FIXME: name and encoding should come from elsewhere
     # FIXME: auto align, load_file, and reloadFile has a lot in common
     def load_file(self, p, name, encodings, isreload=False):
+        self._approximate = False
+        if isreload and self._reload_file(p, name, encodings):
+            return
+
         pane = self._panes[p]
         pre = pane._contents
 
         stat = os.stat(name)
-        s = open(name, 'rb').read()
-        for encoding in encodings:
-            try:
-                post = [ Line(s, i) for i, s in enumerate(_split_lines(s.decode(encoding))) ]
-                pane.set_file_info(name, encoding, stat, pane._next_content_id)
-                break
-            except UnicodeDecodeError:
-                pass
+        encoding = diffuse.reader.probe_encoding(name, encodings)
+        if encoding is None:
+            raise UnicodeDecodeError(', '.join(encodings), b'', 0, 0, 'no encoding can decode %s' % (name, ))
+        if self._huge_file_size is not None and stat.st_size >= max(self._huge_file_size, 1) and diffuse.reader.is_ascii_compatible(encoding):
+            # only the line index is kept in memory, huge files are always
+            # reloaded in full
+            index = diffuse.lineindex.open_index(name, encoding, stat, self._index_cache_dir)
+            buffer = diffuse.lineindex.MappedBuffer(name, encoding, index)
+            pane.set_file_info(name, encoding, stat, pane._next_content_id, index.get_line_endings())
+            pane.set_reload_info(None, None)
+        else:
+            hashes, line_endings = array.array('q'), [ 0, 0, 0 ]
+            buffer = diffuse.linestore.TextBuffer(_hash_lines(diffuse.reader.read_lines(name, encoding, 0, line_endings, self._cancel_event), hashes))
+            # the lines are incomplete if reading was cancelled
+            if self.is_cancelled():
+                return
+            pane.set_file_info(name, encoding, stat, pane._next_content_id, tuple(line_endings))
+            pane.set_reload_info(hashes, diffuse.reader.chunk_checksums(name, 0, stat.st_size, _RELOAD_CHUNK_SIZE))
+        # the old lines are only read again if a change is undone
+        self._close_buffers(p)
+        # lines are compared by their keys while any pane shows a huge file
+        self._use_keys = isinstance(buffer, diffuse.lineindex.MappedBuffer) or any(self._is_huge(q) for q in range(len(self._panes)) if q != p)
+        # rows referencing the buffer, lines are only made when they are used
+        post = pre.new_buffer_store(buffer)
+
+        key, digest, cached = None, None, None
+        pre_digests = [ pane._digests.get(pane._content_id) for pane in self._panes ]
+        if self._diff_cache is not None:
+            digest = hashlib.blake2b(diffuse.reader.digest(name) + codecs.lookup(encoding).name.encode('utf-8')).digest()
+            # time limited alignments may be approximate so are not cached
+            if self._diff_timeout is None:
+                key = self._get_cache_key(p, digest, isreload)
+        if key is not None:
+            cached = self._get_cached_alignment(key, p, post, buffer)
+        if cached is None:
+            new_contents, new_blocks = self._align_file(p, post, isreload)
+            if key is not None and not self.is_cancelled():
+                try:
+                    self._diff_cache.put(key, new_blocks, [ contents.get_spacers() for contents in new_contents ])
+                except OSError:
+                    # the cache is only an optimisation
+                    pass
         else:
-            raise UnicodeDecodeError()
+            new_contents, new_blocks = cached
+
+        # finally update the actual data
+        blocks = list(self._blocks)
+        for pane, contents in zip(self._panes, new_contents):
+            pane.set_contents(0, len(pre), contents)
+        if digest is not None:
+            for q, (pane, d) in enumerate(zip(self._panes, pre_digests)):
+                if q == p:
+                    d = digest
+                if d is not None:
+                    pane._digests[pane._content_id] = d
+
+        self._undo_manager.apply(self.BlockAction(self._blocks, 0, blocks, new_blocks))
 
-        blocks, new_blocks_contents, new_blocks_end = self._blocks, [], []
+    # align the LineStore 'post' of lines loaded into pane 'p' with the other
+    # panes, returns the new contents of every pane and the new blocks
+    def _align_file(self, p, post, isreload):
+        pre = self._panes[p]._contents
+
+        # every block is visited so work from a flat copy
+        blocks, new_blocks_contents, new_blocks_end = list(self._blocks), [], []
 
         if isreload:
             bn, bi, bs, count, idx = len(blocks), 0, 0, 0, 0
 
             # FIXME: should 'pre' be cleaned of uncommitted edits?
-            gcs = self._get_compare_string
-            for idx_0, idx_1, n_match in diffuse.diff.patience_diff([ gcs(c) for c in pre if c ], [ gcs(c) for c in post ]):
+            for idx_0, idx_1, n_match in self._diff(pre, post):
                 idx_0_matched = idx_0 + n_match
                 while bi < bn and count <= idx_0_matched:
                     bs_old = bs
@@ -506,19 +1085,19 @@ class FileCompare:
                     count += sum([ 1 for c in pre[bs_old:bs] if c ])
                     # keep cut if it falls inside the matched segment
                     if idx_0 < old_count < idx_0_matched:
-                        new_blocks_end.append(old_bs)
+                        new_blocks_end.append(bs_old)
                         old_idx = idx
                         idx = idx_1 + old_count - idx_0
-                        new_blocks_contents.append(post[old_idx:idx])
+                        new_blocks_contents.append(post.slice(old_idx, idx))
             new_blocks_end.append(bs)
-            new_blocks_contents.append(post[idx:])
+            new_blocks_contents.append(post.slice(idx, len(post)))
         else:
             new_blocks_end.append(len(pre))
             new_blocks_contents.append(post)
 
         p_left, p_right = self._panes[:p], self._panes[p + 1:]
 
-        new_contents, new_blocks, bi, bs = [ [] for p in self._panes ], [], 0, 0
+        new_contents, new_blocks, bi, bs = [ pane._contents.new_store() for pane in self._panes ], [], 0, 0
         for new_block_end, new_content in zip(new_blocks_end, new_blocks_contents):
             # find range of blocks ending here
             old_bs, old_bi = bs, bi
@@ -528,8 +1107,8 @@ class FileCompare:
 
             # merge new_content with the appropriate part of the other panes
             c_mid, b_mid = [ new_content ], _make_block(len(new_content))
-            c_left = [ pane._contents[old_bs:bs] for pane in p_left ]
-            c_right = [ pane._contents[old_bs:bs] for pane in p_right ]
+            c_left = [ pane._contents.slice(old_bs, bs) for pane in p_left ]
+            c_right = [ pane._contents.slice(old_bs, bs) for pane in p_right ]
 
             b = blocks[old_bi:bi]
             c_mid, b_mid = self._auto_align3(c_left, c_mid, c_right, b, b_mid, b)
@@ -539,18 +1118,14 @@ class FileCompare:
                 dest.extend(c)
             new_blocks.extend(b_mid)
 
-        # finally update the actual data
-        for pane, contents in zip(self._panes, new_contents):
-            pane.set_contents(0, bs, contents)
-
-        self._undo_manager.apply(self.BlockAction(self._blocks, 0, self._blocks[:], new_blocks))
+        return new_contents, new_blocks
 
     def isolate(self, p, i0, i1):
         if len(self._panes) < 2:
             return
 
         # insert cuts
-        b_pre, b_mid, b_post = _cut_blocks(self._blocks, i0, i1)
+        bi, b_span, b_pre, b_mid, b_post = _cut_block_span(self._blocks, i0, i1)
 
         # isolate pane
         p_isolated = self._panes[p]
@@ -560,7 +1135,7 @@ class FileCompare:
 
         panes = self._panes[:p]
         panes.extend(self._panes[p + 1:])
-        c_rest = [ pane._contents[i0:i1] for pane in panes ]
+        c_rest = [ pane._contents.slice(i0, i1) for pane in panes ]
         if len(panes) == 1:
             b_mid = _make_block(i1 - i0)
 
@@ -570,11 +1145,11 @@ class FileCompare:
         p_isolated.set_contents(i0, i1, c_isolated)
 
         for pane, contents in zip(panes, c_rest):
-            c = n * [ None ]
+            c = pane._contents.new_store(n * [ None ])
             c.extend(contents)
             pane.set_contents(i0, i1, c)
 
         be = b_pre.extend
         for b in b_isolated, b_mid, b_post:
             be(b)
-        self._undo_manager.apply(self.BlockAction(self._blocks, 0, self._blocks[:], b_pre))
+        self._undo_manager.apply(self.BlockAction(self._blocks, bi, b_span, b_pre))
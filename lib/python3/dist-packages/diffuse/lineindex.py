@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Derrick Moser <derrick_moser@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import array, codecs, collections, hashlib, itertools, mmap, operator, os, struct, zlib
+
+import diffuse.linestore, diffuse.reader
+
+# number of decoded lines kept by each MappedBuffer
+_CACHE_SIZE = 4096
+
+# typecode of an array of 32 bit checksums
+_U32 = 'I' if array.array('I').itemsize == 4 else 'L'
+
+# sidecar files start with this and a header of the key length, number of
+# lines, and the counts of each kind of line ending
+_MAGIC = b'diffuse-line-index-1\n'
+_HEADER = struct.Struct('<QQQQQ')
+
+# byte offsets of the lines of a file and the keys used to compare them
+class LineIndex:
+    def __init__(self, offsets, crcs, adlers, line_endings):
+        self._offsets = offsets
+        self._crcs = crcs
+        self._adlers = adlers
+        self._line_endings = line_endings
+
+    def __repr__(self):
+        return '<LineIndex n=%d, line_endings=%s/>' % (len(self), repr(self._line_endings))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def get_line_endings(self):
+        return self._line_endings
+
+# build the index of a file in one sequential pass, 'encoding' must be ASCII
+# compatible so lines can be found in the raw bytes
+def build_index(name, encoding):
+    offsets, crcs, adlers, line_endings = array.array('q', [ 0 ]), array.array(_U32), array.array(_U32), [ 0, 0, 0 ]
+    # keys are taken from the raw bytes unless they need re-encoding
+    recode = codecs.lookup(encoding).name not in ('utf-8', 'ascii')
+
+    def add(ss):
+        offsets.extend(itertools.islice(itertools.accumulate(map(len, ss), initial=offsets[-1]), 1, None))
+        if recode:
+            ss = [ str(s, encoding).encode('utf-8', 'surrogatepass') for s in ss ]
+        crcs.extend(map(zlib.crc32, ss))
+        adlers.extend(map(zlib.adler32, ss))
+
+    with open(name, 'rb') as f:
+        tail = b''
+        for b in diffuse.reader.read_chunks(f):
+            b = tail + b
+            ss = b.splitlines(True)
+            tail = ss.pop() if ss else b''
+            diffuse.reader.count_line_endings(b[:len(b) - len(tail)], line_endings)
+            add(ss)
+        if tail:
+            diffuse.reader.count_line_endings(tail, line_endings)
+            add([ tail ])
+    return LineIndex(offsets, crcs, adlers, tuple(line_endings))
+
+# sidecar files are named after the file's path and hold the identity of the
+# file they index so any change to the file makes them stale
+def _get_sidecar_path(cache_dir, name):
+    return os.path.join(cache_dir, hashlib.sha1(os.path.abspath(name).encode('utf-8', 'surrogateescape')).hexdigest() + '.idx')
+
+def _get_sidecar_key(stat, encoding):
+    return repr((stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, codecs.lookup(encoding).name)).encode('utf-8')
+
+def _read_array(f, typecode, n):
+    a = array.array(typecode)
+    a.fromfile(f, n)
+    return a
+
+# the cached index of a file or None if there is no valid cache
+def load_index(cache_dir, name, stat, encoding):
+    key = _get_sidecar_key(stat, encoding)
+    try:
+        with open(_get_sidecar_path(cache_dir, name), 'rb') as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                return None
+            nkey, n, dos, mac, unix = _HEADER.unpack(f.read(_HEADER.size))
+            if f.read(nkey) != key:
+                return None
+            return LineIndex(_read_array(f, 'q', n + 1), _read_array(f, _U32, n), _read_array(f, _U32, n), (dos, mac, unix))
+    except (OSError, EOFError, struct.error):
+        return None
+
+def save_index(cache_dir, name, stat, encoding, index):
+    key, path = _get_sidecar_key(stat, encoding), _get_sidecar_path(cache_dir, name)
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary file so readers never see a partial index
+    temp = '%s.%d' % (path, os.getpid())
+    try:
+        with open(temp, 'wb') as f:
+            f.write(_MAGIC)
+            f.write(_HEADER.pack(len(key), len(index), *index._line_endings))
+            f.write(key)
+            index._offsets.tofile(f)
+            index._crcs.tofile(f)
+            index._adlers.tofile(f)
+        os.replace(temp, path)
+        temp = None
+    finally:
+        if temp is not None:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+
+# index a file reusing the sidecar cache in 'cache_dir' if it is not None
+def open_index(name, encoding, stat, cache_dir=None):
+    index = None
+    if cache_dir is not None:
+        index = load_index(cache_dir, name, stat, encoding)
+    if index is None:
+        index = build_index(name, encoding)
+        if cache_dir is not None:
+            try:
+                save_index(cache_dir, name, stat, encoding, index)
+            except OSError:
+                # the cache is only an optimisation
+                pass
+    return index
+
+# lines of a memory-mapped file decoded on demand using a LineIndex, it has
+# the same interface as TextBuffer
+#
+# touching a page of a map past the end of a truncated file raises SIGBUS so
+# the file's size is checked against the index before each read, lines of a
+# file that changed are read without the map
+class MappedBuffer:
+    def __init__(self, name, encoding, index):
+        self._name = name
+        self._encoding = encoding
+        self._index = index
+        self._map = None
+        self._edits = {}
+        self._start = 0
+        # least recently used decoded lines
+        self._cache = collections.OrderedDict()
+
+    def __repr__(self):
+        return '<MappedBuffer n=%d, edits=%s, mapped=%s/>' % (len(self), repr(self._edits), self._map is not None)
+
+    def __len__(self):
+        return len(self._index)
+
+    # estimated size in bytes of the index, the map is not counted as its
+    # pages can be dropped
+    def get_size(self):
+        index = self._index
+        return sum([ a.itemsize * len(a) for a in (index._offsets, index._crcs, index._adlers) ])
+
+    # release the map, it is made again if more lines are read
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    # bytes [start, end) of the file
+    def _read(self, start, end):
+        size = self._index._offsets[-1]
+        m = self._map
+        if m is None:
+            with open(self._name, 'rb') as f:
+                if os.fstat(f.fileno()).st_size != size:
+                    f.seek(start)
+                    return f.read(end - start)
+                if size == 0:
+                    return b''
+                self._map = m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        elif m.size() != size:
+            self.close()
+            return self._read(start, end)
+        return m[start:end]
+
+    def get_text(self, i):
+        cache = self._cache
+        s = cache.get(i)
+        if s is None:
+            offsets = self._index._offsets
+            s = cache[i] = str(self._read(offsets[i], offsets[i + 1]), self._encoding, 'replace')
+            if len(cache) > _CACHE_SIZE:
+                cache.popitem(False)
+        else:
+            cache.move_to_end(i)
+        return s
+
+    def get_key(self, i):
+        index = self._index
+        return (index._crcs[i] << 32) | index._adlers[i]
+
+    # keys of the lines 'indices', see TextBuffer.get_keys()
+    def get_keys(self, indices):
+        if self._edits:
+            get, get_key, line_key = self._edits.get, self.get_key, diffuse.linestore.line_key
+            return ( get_key(i) if get(i) is None else line_key(get(i)) for i in indices )
+        index, (a, b) = self._index, itertools.tee(indices)
+        return map(operator.or_, map(operator.lshift, map(index._crcs.__getitem__, a), itertools.repeat(32)), map(index._adlers.__getitem__, b))
+
+    def get_edit(self, i):
+        return self._edits.get(i)
+
+    def set_edit(self, i, s):
+        if s is None:
+            self._edits.pop(i, None)
+        else:
+            self._edits[i] = s
+
+    def has_edits(self):
+        return len(self._edits) > 0
+
+    # line numbers of the edited lines
+    def get_edited(self):
+        return self._edits.keys()
+
+    def get_lines(self):
+        return [ diffuse.linestore.BufferLine(self, i) for i in range(len(self)) ]
@@ -0,0 +1,447 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Derrick Moser <derrick_moser@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import array, collections, io, itertools, operator, re, weakref, zlib
+
+import diffuse.rope, diffuse.undo
+
+class Line:
+    __slots__ = ('_text', '_edit', '_line_number')
+
+    def __init__(self, s=None, i=None):
+        self._text = s
+        self._edit = None
+        self._line_number = i
+
+    def __repr__(self):
+        return '<Edit line_number=%d, text=%s, edit=%s/>' % (self._line_number, repr(self._text), repr(self._edit))
+
+# key used to compare lines without their text, two checksums of the
+# line's UTF-8 encoding packed in one integer so keys can be taken from the
+# raw bytes of a file
+def line_key(s):
+    b = s.encode('utf-8', 'surrogatepass')
+    return (zlib.crc32(b) << 32) | zlib.adler32(b)
+
+# text of a file's lines stored in one string with an offset array, edits
+# are kept in a sparse map from line number to the edited text, 'start' is
+# the line number of the first line when only part of a file is read, an undo
+# journal holds buffers weakly so the text of old files leaves memory
+class TextBuffer(diffuse.undo.Paged):
+    def __init__(self, lines, start=0):
+        text, offsets, n = io.StringIO(), array.array('q', [ 0 ]), 0
+        write, append = text.write, offsets.append
+        for s in lines:
+            n += write(s)
+            append(n)
+        self._text = text.getvalue()
+        self._offsets = offsets
+        self._edits = {}
+        self._start = start
+
+    def __repr__(self):
+        return '<TextBuffer n=%d, edits=%s/>' % (len(self), repr(self._edits))
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    # estimated size in bytes of the text and offsets
+    def get_size(self):
+        return len(self._text) + 8 * len(self._offsets)
+
+    def get_text(self, i):
+        offsets = self._offsets
+        return self._text[offsets[i]:offsets[i + 1]]
+
+    def get_key(self, i):
+        return line_key(self.get_text(i))
+
+    # keys of the lines 'indices' including any edits
+    def get_keys(self, indices):
+        get, get_key = self._edits.get, self.get_key
+        for i in indices:
+            s = get(i)
+            yield get_key(i) if s is None else line_key(s)
+
+    def get_edit(self, i):
+        return self._edits.get(i)
+
+    def set_edit(self, i, s):
+        if s is None:
+            self._edits.pop(i, None)
+        else:
+            self._edits[i] = s
+
+    def has_edits(self):
+        return len(self._edits) > 0
+
+    # line numbers of the edited lines
+    def get_edited(self):
+        return self._edits.keys()
+
+    def get_lines(self):
+        return [ BufferLine(self, i) for i in range(len(self)) ]
+
+# a lightweight view of a line in a TextBuffer
+class BufferLine(Line):
+    __slots__ = ('_buffer', '_index')
+
+    def __init__(self, buffer, i):
+        self._buffer = buffer
+        self._index = i
+
+    @property
+    def _text(self):
+        return self._buffer.get_text(self._index)
+
+    @property
+    def _edit(self):
+        return self._buffer.get_edit(self._index)
+
+    @_edit.setter
+    def _edit(self, s):
+        self._buffer.set_edit(self._index, s)
+
+    @property
+    def _line_number(self):
+        return self._buffer._start + self._index
+
+# minimum number of Line objects added to a pool before it is compacted
+_COMPACT_MIN = 4096
+
+# buffers and stand-alone Line objects referenced by a family of LineStores,
+# entries no store uses are dropped when the pool is compacted, their slots
+# are left empty so the IDs of the other entries do not change
+class _Pool:
+    def __init__(self):
+        self._buffers = []
+        self._buffer_ids = {}
+        self._objects = []
+        self._object_ids = {}
+        # stores sharing the pool, their rows decide which entries are live
+        self._stores = weakref.WeakSet()
+        # number of buffer and object slots at the last compaction, entries
+        # added since then may be in rows that are not stored yet so only
+        # older entries are dropped
+        self._marks = 0, 0
+        self._n_added = 0
+        self._n_live = 0
+        self._buffer_added = False
+
+    def get_buffer_id(self, buffer):
+        try:
+            return self._buffer_ids[id(buffer)]
+        except KeyError:
+            k = len(self._buffers)
+            self._buffers.append(buffer)
+            self._buffer_ids[id(buffer)] = k
+            self._buffer_added = True
+            return k
+
+    def get_object_id(self, line):
+        try:
+            return self._object_ids[id(line)]
+        except KeyError:
+            self._objects.append(line)
+            self._object_ids[id(line)] = k = -len(self._objects)
+            self._n_added += 1
+            return k
+
+    def add_store(self, store):
+        self._stores.add(store)
+
+    # compact once a buffer was added, eg. by a reload, or the number of
+    # Line objects has doubled
+    def maybe_compact(self):
+        if self._buffer_added or self._n_added > max(self._n_live, _COMPACT_MIN):
+            self.compact()
+
+    # drop the entries that were added before the last compaction and are
+    # not referenced by the rows of any store
+    def compact(self):
+        values = set()
+        for store in list(self._stores):
+            values.update(store._rows.flatten())
+        n_buffers, n_objects = self._marks
+        # spacer rows are zero so they may keep the first buffer
+        live = set([ v >> _BUFFER_SHIFT for v in values if v >= 0 ])
+        for key, k in list(self._buffer_ids.items()):
+            if k < n_buffers and k not in live:
+                del self._buffer_ids[key]
+                self._buffers[k] = None
+        for key, k in list(self._object_ids.items()):
+            if -k <= n_objects and k not in values:
+                del self._object_ids[key]
+                self._objects[-k - 1] = None
+        self._marks = len(self._buffers), len(self._objects)
+        self._n_added = 0
+        self._n_live = len(self._object_ids)
+        self._buffer_added = False
+
+    # live buffers
+    def get_buffers(self):
+        return [ buffer for buffer in self._buffers if buffer is not None ]
+
+# rows referencing a buffer line are encoded as the buffer's ID in the upper
+# bits and the line number in the lower bits, rows referencing stand-alone
+# Line objects are encoded as negative numbers
+_BUFFER_SHIFT = 40
+_INDEX_MASK = (1 << _BUFFER_SHIFT) - 1
+
+# translation table swapping zero and non-zero flags
+_INVERT = bytes([ 1 ] + 255 * [ 0 ])
+
+# columnar storage for the rows of a pane: a rope of encoded lines and a rope
+# of spacer flags, ropes share structure so slicing and splicing a large pane
+# does not copy its rows
+class LineStore:
+    def __init__(self, lines=None, pool=None):
+        self._pool = pool = _Pool() if pool is None else pool
+        rows, spacers = None, None
+        if lines is not None:
+            rows, spacers = self._encode(lines)
+        if isinstance(rows, diffuse.rope.Rope):
+            self._rows, self._spacers = rows, spacers
+        else:
+            self._rows = diffuse.rope.Rope(array.array('q'), rows)
+            self._spacers = diffuse.rope.Rope(bytearray(), spacers, True)
+        pool.add_store(self)
+        pool.maybe_compact()
+
+    def __repr__(self):
+        return repr(list(self))
+
+    def __len__(self):
+        return len(self._spacers)
+
+    # stores are pickled as flat arrays sharing the pool, rows are written as
+    # differences from the previous row so runs of lines compress well, the
+    # buffers and Line objects they use are kept with them in case the pool
+    # drops them in the meantime
+    def __getstate__(self):
+        pool, rows = self._pool, self._rows.flatten()
+        values = set(rows)
+        buffers = {}
+        for k in set([ v >> _BUFFER_SHIFT for v in values if v >= 0 ]):
+            buffer = pool._buffers[k]
+            if buffer is not None:
+                buffers[k] = buffer
+        objects = dict([ (v, pool._objects[-v - 1]) for v in values if v < 0 ])
+        return pool, buffers, objects, array.array('q', map(operator.sub, rows, itertools.chain((0, ), rows))), self._spacers.flatten()
+
+    def __setstate__(self, state):
+        pool, buffers, objects, deltas, spacers = state
+        self._pool = pool
+        rows = array.array('q', itertools.accumulate(deltas))
+        # map the IDs of entries that had to be added again
+        buffer_map, object_map = {}, {}
+        for k, buffer in buffers.items():
+            new_k = pool.get_buffer_id(buffer)
+            if new_k != k:
+                buffer_map[k] = new_k
+        for k, line in objects.items():
+            new_k = pool.get_object_id(line)
+            if new_k != k:
+                object_map[k] = new_k
+        if buffer_map or object_map:
+            for i, v in enumerate(rows):
+                if v < 0:
+                    rows[i] = object_map.get(v, v)
+                elif not spacers[i] and (v >> _BUFFER_SHIFT) in buffer_map:
+                    rows[i] = (buffer_map[v >> _BUFFER_SHIFT] << _BUFFER_SHIFT) | (v & _INDEX_MASK)
+        self._rows = diffuse.rope.Rope(array.array('q'), rows)
+        self._spacers = diffuse.rope.Rope(bytearray(), spacers, True)
+        pool.add_store(self)
+        pool.maybe_compact()
+
+    def _encode(self, lines):
+        if isinstance(lines, LineStore):
+            if lines._pool is self._pool:
+                return lines._rows.copy(), lines._spacers.copy()
+            lines = list(lines)
+        pool, rows, spacers = self._pool, array.array('q'), bytearray(len(lines))
+        get_buffer_id, append, cache = pool.get_buffer_id, rows.append, {}
+        for i, line in enumerate(lines):
+            if line is None:
+                spacers[i] = 1
+                append(0)
+            elif isinstance(line, BufferLine):
+                buffer = line._buffer
+                try:
+                    k = cache[id(buffer)]
+                except KeyError:
+                    cache[id(buffer)] = k = get_buffer_id(buffer) << _BUFFER_SHIFT
+                append(k | line._index)
+            else:
+                append(pool.get_object_id(line))
+        return rows, spacers
+
+    def _decode(self, v):
+        if v < 0:
+            return self._pool._objects[-v - 1]
+        return BufferLine(self._pool._buffers[v >> _BUFFER_SHIFT], v & _INDEX_MASK)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return list(self.slice(*i.indices(len(self))[:2]))
+        if self._spacers[i]:
+            return None
+        return self._decode(self._rows[i])
+
+    def __iter__(self):
+        decode = self._decode
+        for v, spacer in zip(self._rows, self._spacers):
+            yield None if spacer else decode(v)
+
+    def __setitem__(self, i, lines):
+        start, end = i.indices(len(self))[:2]
+        self.splice(start, max(end - start, 0), lines)
+
+    # new store sharing this store's pool
+    def new_store(self, lines=None):
+        return LineStore(lines, self._pool)
+
+    def slice(self, i, j):
+        result = LineStore(None, self._pool)
+        result._rows, result._spacers = self._rows.slice(i, j), self._spacers.slice(i, j)
+        return result
+
+    # replace 'n' rows starting at 'i' with 'lines'
+    def splice(self, i, n, lines):
+        rows, spacers = self._encode(lines)
+        self._rows.splice(i, n, rows)
+        self._spacers.splice(i, n, spacers)
+        self._pool.maybe_compact()
+
+    def extend(self, lines):
+        self.splice(len(self), 0, lines)
+
+    # true if any line of this store was edited, other stores sharing the pool
+    # may have edits of their own
+    def has_edits(self):
+        pool = self._pool
+        values = set(itertools.compress(self._rows.flatten(), self._spacers.flatten().translate(_INVERT)))
+        for k, line in enumerate(pool._objects):
+            if line is not None and line._edit is not None and -k - 1 in values:
+                return True
+        for k, buffer in enumerate(pool._buffers):
+            if buffer is not None and buffer.has_edits():
+                k <<= _BUFFER_SHIFT
+                if any((k | i) in values for i in buffer.get_edited()):
+                    return True
+        return False
+
+    # keys of the lines of this store skipping spacers, see line_key(), taken
+    # from the buffers for each run of rows so lines are not decoded
+    def get_keys(self):
+        pool, keys = self._pool, array.array('Q')
+        rows = itertools.compress(self._rows.flatten(), self._spacers.flatten().translate(_INVERT))
+        for k, run in itertools.groupby(rows, _BUFFER_SHIFT.__rrshift__):
+            if k < 0:
+                for v in run:
+                    line = pool._objects[-v - 1]
+                    s = line._edit
+                    if s is None:
+                        s = line._text
+                    keys.append(line_key('' if s is None else s))
+            else:
+                keys.extend(pool._buffers[k].get_keys(map(_INDEX_MASK.__and__, run)))
+        return keys
+
+    # (buffer, n) pairs giving the number of lines of this store from each
+    # buffer
+    def get_buffer_counts(self):
+        buffers = self._pool._buffers
+        rows = itertools.compress(self._rows.flatten(), self._spacers.flatten().translate(_INVERT))
+        counts = collections.Counter(map(_BUFFER_SHIFT.__rrshift__, rows))
+        return [ (buffers[k], n) for k, n in counts.items() if k >= 0 ]
+
+    # buffers of the lines of this store
+    def get_buffers(self):
+        buffers = self._pool._buffers
+        rows = itertools.compress(self._rows.flatten(), self._spacers.flatten().translate(_INVERT))
+        return [ buffers[k] for k in sorted(set(map(_BUFFER_SHIFT.__rrshift__, rows))) if k >= 0 ]
+
+    # row of the k-th line not counting spacers, or the number of rows if
+    # there are not that many lines
+    def find_line(self, k):
+        spacers = self._spacers
+        lo, hi = k, len(spacers)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if mid - spacers.prefix_sum(mid) > k:
+                hi = mid
+            else:
+                lo = mid + 1
+        if lo - spacers.prefix_sum(lo) > k:
+            return lo - 1
+        return lo
+
+    # new store sharing this store's pool with every line of 'buffer'
+    def new_buffer_store(self, buffer):
+        k = self._pool.get_buffer_id(buffer) << _BUFFER_SHIFT
+        result = LineStore(None, self._pool)
+        result._rows = diffuse.rope.Rope(array.array('q'), array.array('q', range(k, k + len(buffer))))
+        result._spacers = diffuse.rope.Rope(bytearray(), bytearray(len(buffer)), True)
+        return result
+
+    # new store with this store's lines in order at the rows that are not
+    # flagged in 'spacers', returns None if the number of lines differs
+    def relayout(self, spacers):
+        flags = self._spacers.flatten()
+        if flags.count(0) != spacers.count(0):
+            return None
+        lines = array.array('q', itertools.compress(self._rows.flatten(), flags.translate(_INVERT)))
+        rows, k = array.array('q', bytes(8 * len(spacers))), 0
+        # copy each run of lines
+        for m in re.finditer(b'\x00+', spacers):
+            i, j = m.span()
+            rows[i:j] = lines[k:k + j - i]
+            k += j - i
+        result = LineStore(None, self._pool)
+        result._rows = diffuse.rope.Rope(array.array('q'), rows)
+        result._spacers = diffuse.rope.Rope(bytearray(), bytearray(spacers), True)
+        return result
+
+    def is_spacer(self, i):
+        return self._spacers[i] != 0
+
+    # flags for each row, non-zero for spacer rows
+    def get_spacers(self):
+        return self._spacers.flatten()
+
+    # encoded lines of each row, zero for spacer rows
+    def get_rows(self):
+        return self._rows.flatten()
+
+    def get_string(self, i):
+        if self._spacers[i]:
+            return ''
+        v = self._rows[i]
+        if v < 0:
+            e = self._pool._objects[-v - 1]
+            s = e._edit
+            if s is None:
+                s = e._text
+        else:
+            buffer, idx = self._pool._buffers[v >> _BUFFER_SHIFT], v & _INDEX_MASK
+            s = buffer.get_edit(idx)
+            if s is None:
+                s = buffer.get_text(idx)
+        return '' if s is None else s
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Derrick Moser <derrick_moser@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import threading
+
+import diffuse.dircompare, diffuse.filecompare, diffuse.signal
+
+# runs _load() on a worker thread
+#
+# 'progress' is emitted with (p, n, name) before the p-th of n steps and
+# 'done' is emitted with (result, error) once loading stops, 'result' is
+# None if loading failed or was cancelled, both are emitted on the worker
+# thread so callers must pass them to their own thread
+class _Worker:
+    def __init__(self):
+        self._cancel_event = threading.Event()
+        self._thread = None
+        self._signals = sigs = {}
+        for name in 'progress', 'done':
+            sigs[name] = diffuse.signal.Signal()
+
+    def add_callback(self, name, cb, data=None):
+        return self._signals[name].add_callback(cb, data)
+
+    def is_started(self):
+        return self._thread is not None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    # ask the worker to stop, work in progress is cut short and 'done' is
+    # emitted without a result
+    def cancel(self):
+        self._cancel_event.set()
+
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def join(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        result, error = None, None
+        try:
+            result = self._load()
+        except Exception as e:
+            # any failure must still be reported so the caller can clean up
+            error = e
+        if error is not None or self.is_cancelled():
+            result = None
+        self._signals['done'].emit((result, error))
+
+# loads files into a new FileCompare on a worker thread
+class Loader(_Worker):
+    def __init__(self, n, specs, diff_cache=None):
+        _Worker.__init__(self)
+        # (name, encodings, label) tuples, panes whose name is None are
+        # left empty
+        self._specs = specs
+        self._fc = fc = diffuse.filecompare.FileCompare(n)
+        fc.set_cancel_event(self._cancel_event)
+        fc.set_diff_cache(diff_cache)
+
+    def __repr__(self):
+        return '<Loader specs=%s, started=%s, cancelled=%s/>' % (repr(self._specs), self.is_started(), self.is_cancelled())
+
+    def get_file_compare(self):
+        return self._fc
+
+    def _load(self):
+        fc, specs = self._fc, self._specs
+        for p, (name, encodings, label) in enumerate(specs):
+            if self.is_cancelled():
+                break
+            if name is not None:
+                self._signals['progress'].emit((p, len(specs), name))
+                fc.load_file(p, name, encodings)
+        return fc
+
+# scans directory trees into a new DirCompare on a worker thread
+class DirLoader(_Worker):
+    def __init__(self, roots, encodings=None):
+        _Worker.__init__(self)
+        self._dc = dc = diffuse.dircompare.DirCompare(roots, encodings)
+        dc.set_cancel_event(self._cancel_event)
+
+    def __repr__(self):
+        return '<DirLoader roots=%s, started=%s, cancelled=%s/>' % (repr(self._dc.get_roots()), self.is_started(), self.is_cancelled())
+
+    def get_dir_compare(self):
+        return self._dc
+
+    def _load(self):
+        dc = self._dc
+        self._signals['progress'].emit((0, 1, ', '.join(dc.get_roots())))
+        dc.scan()
+        return dc
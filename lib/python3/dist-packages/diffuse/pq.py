@@ -17,106 +17,191 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import heapq
+
+# marks the slots of lazily removed items
+_REMOVED = object()
+
+# binary max-heap of items with priorities stored in parallel lists, each
+# item is in the queue at most once and inserting it again changes its
+# priority
+#
+# with 'lazy' set, remove() leaves a tombstone instead of restoring the heap,
+# tombstones are dropped when they reach the top or once they make up half
+# of the heap, tombstones share one key in '_lookup' that is never read
 class PriorityQueue:
-    def __init__(self):
-        self._items = [ None ]
+    def __init__(self, lazy=False):
+        self._priorities = []
+        self._items = []
+        # heap index of each item
         self._lookup = {}
+        self._lazy = lazy
+        self._n_removed = 0
 
     def __repr__(self):
-        return '<pq data=%s/>' % (repr(self._items[1:]), )
+        return '<pq data=%s/>' % (repr([ t for t in zip(self._priorities, self._items) if t[1] is not _REMOVED ]), )
 
     def size(self):
-        return len(self._items) - 1
+        return len(self._items) - self._n_removed
 
     def empty(self):
-        return len(self._items) == 1
+        return len(self._items) == self._n_removed
 
     def clear(self):
-        del self._items[1:]
+        del self._priorities[:]
+        del self._items[:]
         self._lookup.clear()
+        self._n_removed = 0
 
     def max_priority(self):
-        return self._items[1][0]
+        self._purge()
+        return self._priorities[0]
 
     def max_item(self):
-        return self._items[1][1]
+        self._purge()
+        return self._items[0]
 
     def insert(self, priority, item):
-        t = (priority, item)
         try:
             i = self._lookup[item]
-            self._items[i] = t
-            if i == 1 or priority < self._items[i // 2][0]:
-                self._move_down(i, t)
-                return
         except KeyError:
             i = len(self._items)
-            self._lookup[item] = i
-            self._items.append(t)
-        self._move_up(i, t)
+            self._priorities.append(priority)
+            self._items.append(item)
+            self._move_up(i, priority, item)
+            return
+        if priority < self._priorities[i]:
+            self._move_down(i, priority, item)
+        else:
+            self._move_up(i, priority, item)
+
+    # insert or update each (priority, item) pair, when many new items are
+    # added they are appended and the heap is rebuilt in linear time
+    # instead of sifting each one
+    def insert_many(self, pairs):
+        lookup, added = self._lookup, {}
+        for priority, item in pairs:
+            if item in lookup:
+                self.insert(priority, item)
+            else:
+                added[item] = priority
+        if 2 * len(added) < len(self._items):
+            for item, priority in added.items():
+                self.insert(priority, item)
+        else:
+            self._priorities.extend(added.values())
+            self._items.extend(added)
+            self._heapify()
 
     def pop(self):
-        item = self._items[1][1]
-        self._remove(1, item)
+        self._purge()
+        item = self._items[0]
+        self._remove_at(0)
         return item
 
+    # up to 'n' items in the order they would be popped
+    def pop_many(self, n):
+        pop = self.pop
+        return [ pop() for i in range(min(n, self.size())) ]
+
+    # up to 'n' items with the highest priorities in decreasing order of
+    # priority without removing them, priorities must be numbers
+    def peek_many(self, n):
+        priorities, items, result = self._priorities, self._items, []
+        size = len(items)
+        candidates = [ (-priorities[0], 0) ] if size else []
+        while candidates and len(result) < n:
+            i = heapq.heappop(candidates)[1]
+            if items[i] is not _REMOVED:
+                result.append(items[i])
+            for c in range(2 * i + 1, min(2 * i + 3, size)):
+                heapq.heappush(candidates, (-priorities[c], c))
+        return result
+
     def remove(self, item):
+        lookup = self._lookup
         try:
-            self._remove(self._lookup[item], item)
+            i = lookup[item]
         except KeyError:
             return
-
-    def _remove(self, i, item):
+        if self._lazy:
+            del lookup[item]
+            self._items[i] = _REMOVED
+            self._n_removed += 1
+            if 2 * self._n_removed > len(self._items):
+                self._compact()
+        else:
+            self._remove_at(i)
+
+    # drop tombstones from the top of the heap
+    def _purge(self):
         items = self._items
-        del self._lookup[item]
-        if len(items) == 2:
-            del items[1]
-            return
-
-        items[i] = t = items[-1]
-        del items[-1]
-        self._lookup[t[1]] = i
-        if i == 1 or t[0] < items[i // 2][0]:
-            self._move_down(i, t)
-            return
-
-        self._move_up(i, t)
-
-    def _move_up(self, i, t):
-        priority, item = t
-        items, lookup = self._items, self._lookup
-        while i != 1:
-            p = i // 2
-            pp, pi = pt = items[p]
+        while self._n_removed and items[0] is _REMOVED:
+            self._n_removed -= 1
+            self._remove_at(0)
+
+    # drop every tombstone
+    def _compact(self):
+        pairs = [ t for t in zip(self._priorities, self._items) if t[1] is not _REMOVED ]
+        self._priorities = [ t[0] for t in pairs ]
+        self._items = [ t[1] for t in pairs ]
+        self._n_removed = 0
+        self._heapify()
+
+    def _heapify(self):
+        priorities, items = self._priorities, self._items
+        self._lookup = { item: i for i, item in enumerate(items) }
+        for i in range(len(items) // 2 - 1, -1, -1):
+            self._move_down(i, priorities[i], items[i])
+
+    def _remove_at(self, i):
+        priorities, items = self._priorities, self._items
+        item = items[i]
+        if item is not _REMOVED:
+            del self._lookup[item]
+        priority, item = priorities.pop(), items.pop()
+        if i < len(items):
+            if i > 0 and priority > priorities[(i - 1) >> 1]:
+                self._move_up(i, priority, item)
+            else:
+                self._move_down(i, priority, item)
+
+    # sift 'item' up from slot 'i' moving parents into the hole instead of
+    # swapping
+    def _move_up(self, i, priority, item):
+        priorities, items, lookup = self._priorities, self._items, self._lookup
+        while i > 0:
+            p = (i - 1) >> 1
+            pp = priorities[p]
             if priority <= pp:
-                return
-
-            items[p] = t
-            items[i] = pt
-            lookup[item] = p
+                break
+            pi = items[p]
+            priorities[i] = pp
+            items[i] = pi
             lookup[pi] = i
             i = p
+        priorities[i] = priority
+        items[i] = item
+        lookup[item] = i
 
-    def _move_down(self, i, t):
-        priority, item = t
-        items, lookup = self._items, self._lookup
+    def _move_down(self, i, priority, item):
+        priorities, items, lookup = self._priorities, self._items, self._lookup
         n = len(items)
         while 1:
-            c1 = 2 * i
-            if c1 >= n:
-                return
-
-            p1, i1 = t1 = items[c1]
-            c2 = c1 + 1
-            if c2 < n:
-                p2, i2 = t2 = items[c2]
-                if p1 < p2:
-                    c1, p1, i1, t1 = c2, p2, i2, t2
-            if p1 < priority:
-                return
-
-            items[c1] = t
-            items[i] = t1
-            lookup[item] = c1
-            lookup[i1] = i
-            i = c1
+            c = 2 * i + 1
+            if c >= n:
+                break
+            pc = priorities[c]
+            c2 = c + 1
+            if c2 < n and pc < priorities[c2]:
+                c, pc = c2, priorities[c2]
+            if pc < priority:
+                break
+            ci = items[c]
+            priorities[i] = pc
+            items[i] = ci
+            lookup[ci] = i
+            i = c
+        priorities[i] = priority
+        items[i] = item
+        lookup[item] = i
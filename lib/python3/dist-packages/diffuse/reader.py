@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Derrick Moser <derrick_moser@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+
+import array, codecs, hashlib, itertools, mmap, zlib
+
+# number of bytes decoded at a time
+_CHUNK_SIZE = 1 << 20
+
+# indices of the counts of each kind of line ending
+DOS, MAC, UNIX = range(3)
+
+# add the number of each kind of line ending in 's' to 'counts', 's' may be
+# text or bytes from an ASCII compatible encoding
+def count_line_endings(s, counts):
+    if isinstance(s, str):
+        cr, nl, crnl = '\r', '\n', '\r\n'
+    else:
+        cr, nl, crnl = b'\r', b'\n', b'\r\n'
+    dos = s.count(crnl)
+    counts[DOS] += dos
+    counts[MAC] += s.count(cr) - dos
+    counts[UNIX] += s.count(nl) - dos
+
+# true if line endings can be found in the raw bytes of 'encoding' and each
+# line decoded on its own, ie. the encoding is stateless and never uses the
+# bytes for '\r' and '\n' inside other characters
+def is_ascii_compatible(encoding):
+    name = codecs.lookup(encoding).name
+    if name not in ('utf-8', 'ascii', 'latin-1') and not name.startswith(('iso8859-', 'cp', 'mac-', 'koi8-')):
+        return False
+    # rule out EBCDIC code pages
+    try:
+        return bytes(range(128)).decode(encoding) == ''.join(map(chr, range(128)))
+    except UnicodeDecodeError:
+        return False
+
+# split into lines on either Mac, Windows, or Unix line endings
+def split_lines(s):
+    i, n, sf, ss, cr, nl = 0, len(s), s.find, [], -1, -1
+    sa = ss.append
+    while i < n:
+        if cr < i:
+            # find the next '\r'
+            cr = sf('\r', i)
+            if cr == -1:
+                cr = n
+        if nl < i:
+            # find the next '\n'
+            nl = sf('\n', i)
+            if nl == -1:
+                nl = n
+        if cr < nl:
+            # found Mac or Windows line ending
+            if cr + 1 < n and s[cr + 1] == '\n':
+                # it is a Windows line ending
+                cr += 1
+            sa(s[i:cr + 1])
+            i = cr + 1
+        else:
+            # found Unix line ending or EOF
+            if nl == n:
+                # it is EOF
+                nl -= 1
+            sa(s[i:nl + 1])
+            i = nl + 1
+    return ss
+
+# read the raw contents of a file in chunks starting at byte 'offset',
+# memory-mapping it when possible
+def read_chunks(f, offset=0):
+    try:
+        m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (ValueError, OSError):
+        # empty files and pipes cannot be mapped
+        if offset:
+            f.seek(offset)
+        while 1:
+            b = f.read(_CHUNK_SIZE)
+            if not b:
+                return
+            yield b
+    else:
+        with m:
+            for i in range(offset, len(m), _CHUNK_SIZE):
+                yield m[i:i + _CHUNK_SIZE]
+
+# CRC-32 of each 'size' byte chunk of bytes [start, end) of a file, equal
+# arrays show that part of a file is unchanged, 'start' should be a multiple
+# of 'size' so the arrays of a file can be extended
+def chunk_checksums(name, start, end, size=1 << 16):
+    crcs, end = array.array('q'), end - start
+    with open(name, 'rb') as f:
+        f.seek(start)
+        while end > 0:
+            s = f.read(min(size, end))
+            if not s:
+                break
+            crcs.append(zlib.crc32(s))
+            end -= len(s)
+    return crcs
+
+# digest of a whole file's bytes, strong enough to treat files with equal
+# digests as identical
+def digest(name):
+    h = hashlib.blake2b()
+    with open(name, 'rb') as f:
+        for b in read_chunks(f):
+            h.update(b)
+    return h.digest()
+
+# find the first of 'encodings' that can decode a whole file, all encodings
+# are tried in a single pass over the file, returns None if none can
+def probe_encoding(name, encodings):
+    candidates = []
+    for encoding in encodings:
+        try:
+            candidates.append((encoding, codecs.getincrementaldecoder(encoding)(), is_ascii_compatible(encoding)))
+        except LookupError:
+            pass
+    with open(name, 'rb') as f:
+        for b in read_chunks(f):
+            ascii, live = b.isascii(), []
+            for candidate in candidates:
+                encoding, decoder, compatible = candidate
+                # ASCII always decodes unless a character is incomplete
+                if not (ascii and compatible and not decoder.getstate()[0]):
+                    try:
+                        decoder.decode(b)
+                    except UnicodeError:
+                        continue
+                live.append(candidate)
+            candidates = live
+            if not candidates:
+                return None
+    for encoding, decoder, compatible in candidates:
+        try:
+            decoder.decode(b'', True)
+            return encoding
+        except UnicodeError:
+            pass
+
+# split raw bytes into lines and decode each one on its own
+def _read_lines_bytes(f, encoding, offset, line_endings, cancel_event):
+    tail, decode = b'', itertools.repeat(encoding)
+    for b in read_chunks(f, offset):
+        if cancel_event is not None and cancel_event.is_set():
+            return
+        b = tail + b
+        ss = b.splitlines(True)
+        # the last line may continue in the next chunk, including a '\r'
+        # that could be the start of a Windows line ending
+        tail = ss.pop() if ss else b''
+        if line_endings is not None:
+            count_line_endings(b[:len(b) - len(tail)], line_endings)
+        yield from map(str, ss, decode)
+    if tail:
+        if line_endings is not None:
+            count_line_endings(tail, line_endings)
+        yield str(tail, encoding)
+
+# incrementally decode a file from byte 'offset' and yield its lines, the
+# first chunk that cannot be decoded raises UnicodeDecodeError, the number
+# of each kind of line ending is added to 'line_endings' if it is not None,
+# reading stops between chunks once the optional threading.Event
+# 'cancel_event' is set and callers must then discard the lines
+def read_lines(name, encoding, offset=0, line_endings=None, cancel_event=None):
+    with open(name, 'rb') as f:
+        if is_ascii_compatible(encoding):
+            yield from _read_lines_bytes(f, encoding, offset, line_endings, cancel_event)
+            return
+        decoder = codecs.getincrementaldecoder(encoding)()
+        tail = ''
+        for b in read_chunks(f, offset):
+            if cancel_event is not None and cancel_event.is_set():
+                return
+            s = tail + decoder.decode(b)
+            ss = split_lines(s)
+            # the last line may continue in the next chunk, including a '\r'
+            # that could be the start of a Windows line ending
+            tail = ss.pop() if ss else ''
+            if line_endings is not None:
+                count_line_endings(s[:len(s) - len(tail)], line_endings)
+            yield from ss
+        s = tail + decoder.decode(b'', True)
+        if line_endings is not None:
+            count_line_endings(s, line_endings)
+        yield from split_lines(s)
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright (C) 2018 Derrick Moser <derrick_moser@yahoo.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
+
+import random
+
+# maximum number of items stored in each node
+_CHUNK_SIZE = 512
+
+# chunks smaller than this are merged with their neighbours when splicing
+_MIN_CHUNK_SIZE = _CHUNK_SIZE // 4
+
+# private generator so tree shapes do not depend on or disturb the
+# application's random state
+_random = random.Random(0)
+
+# nodes are never modified once created so ropes can share them
+class _Node:
+    __slots__ = ('left', 'right', 'chunk', 'count', 'size', 'chunk_total', 'total')
+
+    def __init__(self, left, chunk, right, chunk_total):
+        self.left = left
+        self.right = right
+        self.chunk = chunk
+        self.chunk_total = chunk_total
+        count, size, total = 1, len(chunk), chunk_total
+        if left is not None:
+            count += left.count
+            size += left.size
+            total += left.total
+        if right is not None:
+            count += right.count
+            size += right.size
+            total += right.total
+        self.count = count
+        self.size = size
+        self.total = total
+
+def _size(node):
+    return 0 if node is None else node.size
+
+# randomised merge weighted by the number of nodes on each side, unlike
+# priorities this stays balanced when ropes share or duplicate nodes
+def _merge(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if _random.random() * (a.count + b.count) < a.count:
+        return _Node(a.left, a.chunk, _merge(a.right, b), a.chunk_total)
+    return _Node(_merge(a, b.left), b.chunk, b.right, b.chunk_total)
+
+# split into the first 'k' items and the rest
+def _split(node, k, summed):
+    if node is None:
+        return None, None
+    n = _size(node.left)
+    if k <= n:
+        if k == 0:
+            return None, node
+        a, b = _split(node.left, k, summed)
+        return a, _Node(b, node.chunk, node.right, node.chunk_total)
+    k -= n
+    chunk = node.chunk
+    n = len(chunk)
+    if k >= n:
+        a, b = _split(node.right, k - n, summed)
+        return _Node(node.left, chunk, a, node.chunk_total), b
+    # split the chunk itself
+    c1, c2 = chunk[:k], chunk[k:]
+    t1 = sum(c1) if summed else 0
+    return _Node(node.left, c1, None, t1), _Node(None, c2, node.right, node.chunk_total - t1)
+
+# build a balanced tree from chunks[lo:hi]
+def _build_range(chunks, lo, hi, summed):
+    if lo >= hi:
+        return None
+    mid = (lo + hi) // 2
+    chunk = chunks[mid]
+    left = _build_range(chunks, lo, mid, summed)
+    right = _build_range(chunks, mid + 1, hi, summed)
+    return _Node(left, chunk, right, sum(chunk) if summed else 0)
+
+# build a balanced tree from a sequence in linear time, items are spread
+# evenly over the chunks
+def _build(seq, summed):
+    n = len(seq)
+    k = (n + _CHUNK_SIZE - 1) // _CHUNK_SIZE
+    chunks = [ seq[i * n // k:(i + 1) * n // k] for i in range(k) ]
+    return _build_range(chunks, 0, len(chunks), summed)
+
+def _first_chunk(node):
+    while node.left is not None:
+        node = node.left
+    return node.chunk
+
+def _last_chunk(node):
+    while node.right is not None:
+        node = node.right
+    return node.chunk
+
+# concatenate two trees, the chunks either side of the seam are rebuilt
+# together if either is small so repeated edits do not leave a node per item
+def _join(a, b, summed):
+    if a is not None and b is not None:
+        c1, c2 = _last_chunk(a), _first_chunk(b)
+        if len(c1) < _MIN_CHUNK_SIZE or len(c2) < _MIN_CHUNK_SIZE:
+            a = _split(a, a.size - len(c1), summed)[0]
+            b = _merge(_build(c1 + c2, summed), _split(b, len(c2), summed)[1])
+    return _merge(a, b)
+
+# persistent sequence supporting O(log n) indexing, slicing, and splicing
+# 'empty' is an empty instance of the chunk type, eg. array.array('q') or
+# bytearray(), and 'summed' enables prefix sum queries for numeric items
+class Rope:
+    def __init__(self, empty, seq=None, summed=False):
+        self._empty = empty
+        self._summed = summed
+        self._root = None
+        if seq:
+            self.splice(0, 0, seq)
+
+    def __repr__(self):
+        return '<Rope items=%s/>' % (repr(list(self)), )
+
+    def __len__(self):
+        return _size(self._root)
+
+    def _new(self, root):
+        result = Rope(self._empty, None, self._summed)
+        result._root = root
+        return result
+
+    # copies share all nodes and cost O(1)
+    def copy(self):
+        return self._new(self._root)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return self.slice(*i.indices(len(self))[:2])
+        node = self._root
+        if i < 0:
+            i += _size(node)
+        if i < 0 or i >= _size(node):
+            raise IndexError('rope index out of range')
+        while 1:
+            n = _size(node.left)
+            if i < n:
+                node = node.left
+                continue
+            i -= n
+            n = len(node.chunk)
+            if i < n:
+                return node.chunk[i]
+            i -= n
+            node = node.right
+
+    def __setitem__(self, i, seq):
+        start, end = i.indices(len(self))[:2]
+        self.splice(start, max(end - start, 0), seq)
+
+    def chunks(self):
+        stack, node = [], self._root
+        while stack or node is not None:
+            while node is not None:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            yield node.chunk
+            node = node.right
+
+    def __iter__(self):
+        for chunk in self.chunks():
+            yield from chunk
+
+    # the items as a single sequence of the chunk type
+    def flatten(self):
+        result = self._empty[:0]
+        for chunk in self.chunks():
+            result += chunk
+        return result
+
+    def slice(self, i, j):
+        summed = self._summed
+        if j < i:
+            j = i
+        a, b = _split(self._root, j, summed)
+        a, b = _split(a, i, summed)
+        return self._new(b)
+
+    # replace 'n' items starting at 'i' with 'seq', which may also be a Rope
+    def splice(self, i, n, seq):
+        summed = self._summed
+        a, b = _split(self._root, i, summed)
+        b, c = _split(b, n, summed)
+        if isinstance(seq, Rope):
+            b = seq._root
+        else:
+            if not isinstance(seq, type(self._empty)):
+                chunk = self._empty[:0]
+                chunk.extend(seq)
+                seq = chunk
+            b = _build(seq, summed)
+        self._root = _join(_join(a, b, summed), c, summed)
+
+    def total(self):
+        return 0 if self._root is None else self._root.total
+
+    # sum of the first 'i' items
+    def prefix_sum(self, i):
+        node, result = self._root, 0
+        while node is not None:
+            n = _size(node.left)
+            if i <= n:
+                node = node.left
+                continue
+            if node.left is not None:
+                result += node.left.total
+            i -= n
+            chunk = node.chunk
+            if i <= len(chunk):
+                return result + sum(chunk[:i])
+            result += node.chunk_total
+            i -= len(chunk)
+            node = node.right
+        return result
+
+    # find the item containing offset 'v' in the running sum, returns the
+    # item's index and the sum of the items before it
+    def find(self, v):
+        node, idx, start = self._root, 0, 0
+        while node is not None:
+            left = node.left
+            if left is not None and v < start + left.total:
+                node = left
+                continue
+            if left is not None:
+                idx += left.size
+                start += left.total
+            if v < start + node.chunk_total:
+                for x in node.chunk:
+                    if v < start + x:
+                        return idx, start
+                    idx += 1
+                    start += x
+            idx += len(node.chunk)
+            start += node.chunk_total
+            node = node.right
+        return idx, start
@@ -19,33 +19,92 @@
 
 import weakref
 
+# callbacks are called with the signal, their data and the emitted data, while
+# frozen emissions are held back and delivered when thawed, 'merge' may be
+# given to combine a held back value with the next one, it returns None if
+# they cannot be combined
 class Signal:
-    def __init__(self):
+    def __init__(self, merge=None):
         self._callbacks = {}
         self._next_id = 0
+        # (function, object reference, callback data) of the live callbacks,
+        # rebuilt when callbacks are added, removed or die
+        self._dispatch = ()
+        # called when a callback dies, it only holds a weak reference so
+        # callbacks do not keep the signal alive
+        self_ref = weakref.ref(self)
+        def callback_died(ref):
+            sig = self_ref()
+            if sig is not None:
+                sig._dispatch = None
+        self._callback_died = callback_died
+        self._merge = merge
+        self._depth = 0
+        self._pending = []
 
     def __repr__(self):
-        return '<Signal callbacks=%s/>' % (repr(self._callbacks), )
+        return '<Signal callbacks=%s, depth=%d, pending=%s/>' % (repr(self._callbacks), self._depth, repr(self._pending))
 
     def add_callback(self, callback, callback_data=None):
         cur_id = self._next_id
         self._next_id += 1
-        self._callbacks[cur_id] = weakref.WeakMethod(callback), callback_data
+        self._callbacks[cur_id] = weakref.WeakMethod(callback, self._callback_died), callback_data
+        self._dispatch = None
         return cur_id
 
     def remove_callback(self, cur_id):
         del self._callbacks[cur_id]
+        self._dispatch = None
 
-    def emit(self, data=None):
-        cbs, r = [], []
+    # drop dead callbacks and snapshot the live ones, methods are called
+    # through their function and a plain reference to their object to
+    # avoid creating a bound method on each emit
+    def _get_dispatch(self):
+        dispatch, r = [], []
         for k, v in self._callbacks.items():
             callback, callback_data = v
             cb = callback()
             if cb:
-                cbs.append((cb, callback_data))
+                dispatch.append((cb.__func__, weakref.ref(cb.__self__), callback_data))
             else:
                 r.append(k)
-        for callback, callback_data in cbs:
-            callback(self, callback_data, data)
         for k in r:
             del self._callbacks[k]
+        self._dispatch = dispatch = tuple(dispatch)
+        return dispatch
+
+    def freeze(self):
+        self._depth += 1
+
+    def thaw(self):
+        self._depth -= 1
+        if self._depth == 0:
+            pending, self._pending = self._pending, []
+            for data in pending:
+                self._emit(data)
+
+    def is_frozen(self):
+        return self._depth > 0
+
+    def emit(self, data=None):
+        if not self._callbacks:
+            return
+        if self._depth > 0:
+            pending, merge = self._pending, self._merge
+            if pending and merge is not None:
+                merged = merge(pending[-1], data)
+                if merged is not None:
+                    pending[-1] = merged
+                    return
+            pending.append(data)
+        else:
+            self._emit(data)
+
+    def _emit(self, data):
+        dispatch = self._dispatch
+        if dispatch is None:
+            dispatch = self._get_dispatch()
+        for func, ref, callback_data in dispatch:
+            obj = ref()
+            if obj is not None:
+                func(obj, self, callback_data, data)
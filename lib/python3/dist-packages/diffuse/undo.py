@@ -17,57 +17,337 @@
 # with this program; if not, write to the Free Software Foundation, Inc.,
 # 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA.
 
+import array, io, pickle, tempfile, types, weakref, zlib
+
+# estimated size in bytes of an action without any data it records
+ACTION_SIZE = 64
+
+# default limit on the estimated size of the undo history
+_MAX_SIZE = 1 << 27
+
+# estimated size of an action, actions may define get_size() to count the
+# data they record
+def get_size(action):
+    get_size = getattr(action, 'get_size', None)
+    return ACTION_SIZE if get_size is None else get_size()
+
+# block 'a' followed by block 'b', adjacent actions are combined using their
+# merge() methods so a run of edits to one line becomes a single action
+def _merge_blocks(a, b):
+    result = list(a)
+    for y in b:
+        merge = getattr(result[-1], 'merge', None) if result else None
+        z = None if merge is None else merge(y)
+        if z is None:
+            result.append(y)
+        else:
+            result[-1] = z
+    return result
+
+# objects of classes deriving from this are written to a journal once and are
+# then only held weakly so they leave memory when nothing else uses them, eg.
+# the text of a file that only old undo blocks show, they are read back when
+# a block using them is read back after they were dropped
+class Paged:
+    pass
+
+# objects of these types are written to a journal by value
+_VALUE_TYPES = (type(None), bool, int, float, complex, str, bytes, bytearray, tuple, list, dict, array.array, type, types.FunctionType, types.BuiltinFunctionType)
+
+# writes a block's actions, plain data and objects defining __getstate__ by
+# value, Paged objects are written as the negative page ID that 'get_page_id'
+# returns, anything else, eg. the files the actions modify, is appended to
+# 'refs' and written as its index
+class _Pickler(pickle.Pickler):
+    def __init__(self, f, block, refs, get_page_id):
+        pickle.Pickler.__init__(self, f, pickle.HIGHEST_PROTOCOL)
+        self._actions = set([ id(a) for a in block ])
+        self._refs = refs
+        self._ref_ids = {}
+        self._get_page_id = get_page_id
+
+    def persistent_id(self, obj):
+        if isinstance(obj, Paged):
+            return self._get_page_id(obj)
+        if type(obj) in _VALUE_TYPES or id(obj) in self._actions or '__getstate__' in type(obj).__dict__:
+            return None
+        try:
+            return self._ref_ids[id(obj)]
+        except KeyError:
+            refs = self._refs
+            self._ref_ids[id(obj)] = k = len(refs)
+            refs.append(obj)
+            return k
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, f, refs, load_page):
+        pickle.Unpickler.__init__(self, f)
+        self._refs = refs
+        self._load_page = load_page
+
+    def persistent_load(self, pid):
+        if pid < 0:
+            return self._load_page(pid)
+        return self._refs[pid]
+
+# blocks of actions written to a file so they do not stay in memory, the file
+# is only appended to and is emptied once every block has been read back or
+# discarded, a temporary file is used if 'path' is None
+class Journal:
+    def __init__(self, path=None):
+        self._path = path
+        self._file = tempfile.TemporaryFile() if path is None else open(path, 'w+b')
+        self._end = 0
+        # number of blocks that have not been read back or discarded
+        self._count = 0
+        # offset, length, and a weak reference to each Paged object written
+        self._pages = []
+        self._page_ids = weakref.WeakKeyDictionary()
+
+    def __repr__(self):
+        return '<Journal path=%s, size=%d, count=%d/>' % (repr(self._path), self._end, self._count)
+
+    def __len__(self):
+        return self._count
+
+    # size in bytes of the file
+    def get_size(self):
+        return self._end
+
+    # write 'block' with its estimated size 'n', returns a record used to
+    # read it back
+    def write(self, block, n):
+        data, refs = io.BytesIO(), []
+        _Pickler(data, block, refs, self._get_page_id).dump(block)
+        offset, length = self._append(data.getvalue())
+        self._count += 1
+        return offset, length, refs, n
+
+    # compress and append 'data' to the file, returns its offset and length
+    def _append(self, data):
+        data = zlib.compress(data, 1)
+        f = self._file
+        f.seek(self._end)
+        f.write(data)
+        offset = self._end
+        self._end += len(data)
+        return offset, len(data)
+
+    def _get_page_id(self, obj):
+        k = self._page_ids.get(obj)
+        if k is None:
+            offset, length = self._append(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+            self._pages.append([ offset, length, weakref.ref(obj) ])
+            self._page_ids[obj] = k = -len(self._pages)
+        return k
+
+    # the Paged object with ID 'k', it is read back if it was dropped
+    def _load_page(self, k):
+        page = self._pages[-k - 1]
+        obj = page[2]()
+        if obj is None:
+            offset, length = page[:2]
+            f = self._file
+            f.seek(offset)
+            obj = pickle.loads(zlib.decompress(f.read(length)))
+            page[2] = weakref.ref(obj)
+            self._page_ids[obj] = k
+        return obj
+
+    # the block and estimated size of 'record', the record may not be used
+    # again
+    def read(self, record):
+        offset, length, refs, n = record
+        f = self._file
+        f.seek(offset)
+        block = _Unpickler(io.BytesIO(zlib.decompress(f.read(length))), refs, self._load_page).load()
+        self.discard(record)
+        return block, n
+
+    def discard(self, record):
+        self._count -= 1
+        if self._count == 0:
+            self._file.truncate(0)
+            self._end = 0
+            self._pages = []
+            self._page_ids = weakref.WeakKeyDictionary()
+
+    def close(self):
+        self._file.close()
+
+# blocks of actions are kept with their estimated size, the oldest blocks are
+# dropped once the history is larger than 'max_size' bytes, None removes the
+# limit, with a Journal the oldest undo and redo blocks are instead written
+# to it and read back when they are reached
+#
+# added signals are frozen while a block is open and while a block is undone
+# or redone so listeners see one consolidated change
 class UndoManager:
-    def __init__(self):
+    def __init__(self, max_size=_MAX_SIZE):
         self._enabled = False
         self._depth = 0
         self._block = None
         self._undos = []
         self._redos = []
+        self._max_size = max_size
+        self._size = 0
+        # true if the last block was a single-line text edit that the next
+        # one may be merged with
+        self._mergeable = False
+        # true while every open block is a single-line text edit
+        self._block_mergeable = False
+        self._journal = None
+        # journal records of the blocks before '_undos' and '_redos', the
+        # last is the next one reached
+        self._spilled_undos = []
+        self._spilled_redos = []
+        # signals frozen by blocks, held weakly in the order they were added
+        self._signals = weakref.WeakKeyDictionary()
+        self._frozen = []
 
     def __repr__(self):
-        return '<UndoManager block=%s, depth=%d, undos=%s, redos=%s/>' % (repr(self._block), self._depth, repr(self._undos), repr(self._redos))
+        return '<UndoManager block=%s, depth=%d, size=%d, undos=%s, redos=%s, spilled=%d/>' % (repr(self._block), self._depth, self._size, repr(self._undos), repr(self._redos), len(self._spilled_undos) + len(self._spilled_redos))
 
     def enable(self):
         self._enabled = True
 
-    def begin_block(self):
+    def add_signal(self, signal):
+        self._signals[signal] = None
+        if self._depth > 0:
+            signal.freeze()
+            self._frozen.append(signal)
+
+    def _freeze(self):
+        self._frozen = frozen = list(self._signals.keys())
+        for signal in frozen:
+            signal.freeze()
+
+    def _thaw(self):
+        frozen, self._frozen = self._frozen, []
+        for signal in frozen:
+            signal.thaw()
+
+    # 'mergeable' marks the block as a single-line text edit, consecutive
+    # edits like this become one undo step, eg. typing on one line
+    def begin_block(self, mergeable=False):
         if self._block is None:
             self._block = []
+        if self._depth == 0:
+            self._block_mergeable = mergeable
+            self._freeze()
+        else:
+            self._block_mergeable = self._block_mergeable and mergeable
         self._depth += 1
 
     def end_block(self):
         self._depth -= 1
         if self._depth == 0:
-            if self._block:
-                self._undos.append(self._block)
+            block = self._block
             self._block = None
+            if block:
+                mergeable = self._block_mergeable
+                if mergeable and self._mergeable and self._undos:
+                    self._size -= self._undos[-1][1]
+                    block = _merge_blocks(self._undos.pop()[0], block)
+                n = sum([ get_size(a) for a in block ])
+                self._undos.append((block, n))
+                self._size += n
+                self._mergeable = mergeable
+                self._evict()
+            self._thaw()
+
+    # drop or spill the oldest blocks until the history fits, the next undo
+    # and redo blocks are always kept
+    def _evict(self):
+        max_size, journal = self._max_size, self._journal
+        if max_size is None:
+            return
+        lists = [ (self._undos, self._spilled_undos) ]
+        if journal is not None:
+            lists.append((self._redos, self._spilled_redos))
+        for blocks, spilled in lists:
+            k = 0
+            while self._size > max_size and k < len(blocks) - 1:
+                block, n = blocks[k]
+                if journal is not None:
+                    spilled.append(journal.write(block, n))
+                self._size -= n
+                k += 1
+            del blocks[:k]
+
+    def set_max_size(self, max_size):
+        self._max_size = max_size
+        self._evict()
+
+    # blocks already spilled are lost if the journal is removed
+    def set_journal(self, journal):
+        self._discard(self._spilled_undos)
+        self._discard(self._spilled_redos)
+        self._journal = journal
+        self._evict()
+
+    def _discard(self, spilled):
+        for record in spilled:
+            self._journal.discard(record)
+        del spilled[:]
+
+    # read the next block back from the journal if none are in memory
+    def _page_in(self, blocks, spilled):
+        if not blocks and spilled:
+            block, n = self._journal.read(spilled.pop())
+            blocks.append((block, n))
+            self._size += n
+
+    # estimated size in bytes of the recorded actions
+    def get_size(self):
+        return self._size
 
     def apply(self, action):
         if self._enabled:
             self._block.append(action)
+            for block, n in self._redos:
+                self._size -= n
             self._redos = []
+            self._discard(self._spilled_redos)
         action.redo()
 
     def redo(self):
         assert self._block is None
+        self._page_in(self._redos, self._spilled_redos)
         if self._redos:
-            actions = self._redos.pop()
+            actions, n = self._redos.pop()
             actions.reverse()
-            for a in actions:
-                a.redo()
-            self._undos.append(actions)
+            self._freeze()
+            try:
+                for a in actions:
+                    a.redo()
+            finally:
+                self._thaw()
+            self._undos.append((actions, n))
+            self._mergeable = False
+            self._evict()
 
     def undo(self):
         assert self._block is None
+        self._page_in(self._undos, self._spilled_undos)
         if self._undos:
-            actions = self._undos.pop()
+            actions, n = self._undos.pop()
             actions.reverse()
-            for a in actions:
-                a.undo()
-            self._redos.append(actions)
+            self._freeze()
+            try:
+                for a in actions:
+                    a.undo()
+            finally:
+                self._thaw()
+            self._redos.append((actions, n))
+            self._mergeable = False
+            self._evict()
 
     def clear(self):
         assert self._block is None
         self._undos = []
         self._redos = []
+        self._discard(self._spilled_undos)
+        self._discard(self._spilled_redos)
+        self._size = 0
+        self._mergeable = False
@@ -0,0 +1,20 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os, random, sys, time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', os.path.join('lib', 'python3', 'dist-packages'))))
+
+import diffuse.diff
+
+# random lines drawn from few values are the worst case for Myers and the
+# histogram diff, the shared budget keeps them close to the patience diff
+n = 20000
+random.seed(0)
+a = [ random.randrange(150) for i in range(n) ]
+b = [ random.randrange(150) for i in range(n) ]
+for name in diffuse.diff.get_engine_names():
+    budget = diffuse.diff.Budget()
+    start = time.monotonic()
+    m = diffuse.diff.get_engine(name)(a, b, budget)
+    print('%-10s %6.2f s, cost %d, approximate %s, %d lines matched' % (name, time.monotonic() - start, budget.get_total_cost(), budget.is_approximate(), sum([ t[2] for t in m ])))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import heapq, os, random, sys, timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', os.path.join('lib', 'python3', 'dist-packages'))))
+
+import diffuse.acache, diffuse.pq
+
+n = 100000
+random.seed(0)
+priorities = [ random.randrange(1000) for i in range(n) ]
+pairs = list(zip(priorities, range(n)))
+
+def bench(name, f, number=5):
+    print('%-40s %8.2f ms' % (name, 1e3 * timeit.timeit(f, number=number) / number))
+
+def insert_each():
+    pq = diffuse.pq.PriorityQueue()
+    for priority, item in pairs:
+        pq.insert(priority, item)
+
+def insert_many():
+    diffuse.pq.PriorityQueue().insert_many(pairs)
+
+def heapq_push():
+    h = []
+    for priority, item in pairs:
+        heapq.heappush(h, (-priority, item))
+
+def heapq_heapify():
+    heapq.heapify([ (-priority, item) for priority, item in pairs ])
+
+bench('PriorityQueue.insert x %d' % (n, ), insert_each)
+bench('PriorityQueue.insert_many(%d)' % (n, ), insert_many)
+bench('heapq.heappush x %d' % (n, ), heapq_push)
+bench('heapq.heapify(%d)' % (n, ), heapq_heapify)
+
+def pop_each():
+    pq = diffuse.pq.PriorityQueue()
+    pq.insert_many(pairs)
+    while not pq.empty():
+        pq.pop()
+
+def pop_many():
+    pq = diffuse.pq.PriorityQueue()
+    pq.insert_many(pairs)
+    pq.pop_many(n)
+
+def heapq_pop():
+    h = [ (-priority, item) for priority, item in pairs ]
+    heapq.heapify(h)
+    while h:
+        heapq.heappop(h)
+
+bench('build and PriorityQueue.pop x %d' % (n, ), pop_each, 2)
+bench('build and PriorityQueue.pop_many(%d)' % (n, ), pop_many, 2)
+bench('heapify and heapq.heappop x %d' % (n, ), heapq_pop, 2)
+
+def remove_each(lazy):
+    pq = diffuse.pq.PriorityQueue(lazy)
+    pq.insert_many(pairs)
+    for i in range(0, n, 2):
+        pq.remove(i)
+
+bench('PriorityQueue.remove x %d' % (n // 2, ), lambda: remove_each(False), 2)
+bench('lazy PriorityQueue.remove x %d' % (n // 2, ), lambda: remove_each(True), 2)
+
+# invalidating a range of lines of an AccumulationCache
+def invalidate():
+    ac = diffuse.acache.AccumulationCache(lambda i: 1)
+    ac.get_partial_sum(n - 1)
+    ac.invalidate(0, n)
+
+bench('AccumulationCache.invalidate(0, %d)' % (n, ), invalidate)
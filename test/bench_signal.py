@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os, sys, timeit, weakref
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', os.path.join('lib', 'python3', 'dist-packages'))))
+
+import diffuse.signal
+
+class Widget:
+    def __init__(self):
+        self._n = 0
+
+    def callback(self, sig, cb_data, data):
+        self._n += 1
+
+# the previous emit that resolved every callback on each call
+def emit_uncached(callbacks, sig, data):
+    cbs, r = [], []
+    for k, v in callbacks.items():
+        callback, callback_data = v
+        cb = callback()
+        if cb:
+            cbs.append((cb, callback_data))
+        else:
+            r.append(k)
+    for callback, callback_data in cbs:
+        callback(sig, callback_data, data)
+    for k in r:
+        del callbacks[k]
+
+n_emits = 100000
+for n_callbacks in 1, 4, 16:
+    widgets = [ Widget() for i in range(n_callbacks) ]
+    s = diffuse.signal.Signal()
+    callbacks = {}
+    for i, w in enumerate(widgets):
+        s.add_callback(w.callback)
+        callbacks[i] = weakref.WeakMethod(w.callback), None
+    t_cached = timeit.timeit(lambda: s.emit(1), number=n_emits)
+    t_uncached = timeit.timeit(lambda: emit_uncached(callbacks, s, 1), number=n_emits)
+    print('%2d callbacks: %.2f us/emit cached, %.2f us/emit uncached' % (n_callbacks, 1e6 * t_cached / n_emits, 1e6 * t_uncached / n_emits))
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import io, json, os, sys, tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', os.path.join('lib', 'python3', 'dist-packages'))))
+
+import diffuse.batch, diffuse.diff
+
+names = []
+for s in 'a\nb\nc\nd\n', 'a\nB\nc\nd\ne':
+    fd, name = tempfile.mkstemp()
+    os.write(fd, s.encode('utf-8'))
+    os.close(fd)
+    names.append(name)
+
+for fmt in diffuse.batch.FORMATS:
+    out = io.StringIO()
+    print(fmt, diffuse.batch.main([ '--batch', '--format', fmt, '-l', 'left', names[0], '-l', 'right', names[1] ], out))
+    print(out.getvalue())
+
+out = io.StringIO()
+print(diffuse.batch.main([ '--format', 'stats', names[0], names[0], '-t', names[1], names[1] ], out))
+print(out.getvalue())
+
+# errors are reported and give exit code 2
+err = io.StringIO()
+print(diffuse.batch.main([ names[0] ], io.StringIO(), err), err.getvalue())
+
+# manifests give one JSON line per entry, identical files are not diffed
+fd, manifest = tempfile.mkstemp()
+os.write(fd, ('# comment\n%s\t%s\n%s\t%s\n\n%s\t%s\t%s\n' % (names[0], names[1], names[0], names[0], names[1], names[0], names[1])).encode('utf-8'))
+os.close(fd)
+for jobs in '1', '2':
+    out = io.StringIO()
+    print(diffuse.batch.main([ '--batch', '--manifest', manifest, '-j', jobs ], out))
+    for line in out.getvalue().splitlines():
+        result = json.loads(line)
+        del result['files'], result['seconds']
+        print(result)
+os.remove(manifest)
+
+# an approximate diff while loading any of the files is reported
+calls = []
+is_approximate = diffuse.diff.Budget.is_approximate
+def approximate_once(budget):
+    calls.append(budget)
+    return len(calls) == 1 or is_approximate(budget)
+diffuse.diff.Budget.is_approximate = approximate_once
+out = io.StringIO()
+diffuse.batch.main([ '--format', 'stats', '-l', 'left', names[0], '-l', 'right', names[1], '-l', 'left', names[0] ], out)
+print(out.getvalue())
+del calls[:]
+result = diffuse.batch.compare_entry((0, [ names[0], names[1], names[0] ], [ 'utf-8' ], None))
+print(result['approximate'])
+diffuse.diff.Budget.is_approximate = is_approximate
+
+# unexpected failures are reported with their entry
+def compare(specs, cache_dir=None):
+    raise RuntimeError('broken')
+compare, diffuse.batch.compare = diffuse.batch.compare, compare
+result = diffuse.batch.compare_entry((0, names, None, None))
+del result['files'], result['seconds']
+print(result)
+diffuse.batch.compare = compare
+
+for name in names:
+    os.remove(name)
+print('gi' in sys.modules)
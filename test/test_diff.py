@@ -7,6 +7,80 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..',
 
 import diffuse.diff
 
+# pin the output format of patience_diff
+for a, b, expected in [
+    ('', '', [(0, 0, 0)]),
+    ('abc', '', [(3, 0, 0)]),
+    ('', 'abc', [(0, 3, 0)]),
+    ('abc', 'abc', [(0, 0, 3), (3, 3, 0)]),
+    ('abcab', 'cbabac', [(0, 2, 2), (2, 5, 1), (5, 6, 0)]),
+    ('aaaaab', 'aaaab', [(1, 0, 5), (6, 5, 0)]),
+    ('xabcdy', 'zabcdw', [(1, 1, 4), (6, 6, 0)]),
+    ('abcdef', 'abxdyf', [(0, 0, 2), (3, 3, 1), (5, 5, 1), (6, 6, 0)]),
+    ('the quick brown fox', 'a quick brown dog', [(3, 1, 13), (17, 15, 1), (19, 17, 0)]),
+    (['{', 'a', '}', '{', 'b', '}'], ['{', 'b', '}', '{', 'a', '}'], [(0, 3, 3), (6, 6, 0)]) ]:
+    m = diffuse.diff.patience_diff(a, b)
+    assert m == expected, (a, b, m)
+
+# Myers and histogram share one budget across all sections, once it runs out
+# the work charged only overshoots by the last step
+import random
+random.seed(0)
+a = [ random.randrange(150) for i in range(2000) ]
+b = [ random.randrange(150) for i in range(2000) ]
+for name in 'myers', 'histogram':
+    budget = diffuse.diff.Budget(max_total_cost=10000, cost_per_element=0)
+    m = diffuse.diff.get_engine(name)(a, b, budget)
+    assert budget.is_approximate(), name
+    assert budget.get_total_cost() <= 10000 + 2 * (len(a) + len(b) + 1), (name, budget.get_total_cost())
+    assert m[-1] == (len(a), len(b), 0)
+    for idx_a, idx_b, n in m:
+        assert a[idx_a:idx_a + n] == b[idx_b:idx_b + n]
+
+# lines the approximate LCS treats as popular are only matched by extending
+# earlier matches, every block must still hold equal lines
+approximate = 0
+for k in range(300):
+    a = [ random.randrange(8) for i in range(random.randrange(100, 400)) ]
+    b = [ random.randrange(8) for i in range(random.randrange(100, 400)) ]
+    budget = diffuse.diff.Budget(max_cost=2000)
+    for idx_a, idx_b, n in diffuse.diff.patience_diff(a, b, budget):
+        assert a[idx_a:idx_a + n] == b[idx_b:idx_b + n], (k, idx_a, idx_b, n)
+    approximate += budget.is_approximate()
+assert approximate > 0
+
+if len(sys.argv) < 3:
+    sys.exit(0)
+
 a, b = sys.argv[1], sys.argv[2]
 m = diffuse.diff.patience_diff(a, b)
 print('diff(%s, %s) = %s' % (repr(a), repr(b), repr(m)))
+
+# the same diff computed on interned tokens
+t = diffuse.diff.Tokenizer()
+print('tokens(%s, %s) = %s' % (repr(a), repr(b), repr(diffuse.diff.patience_diff(t.tokenize(a), t.tokenize(b)))))
+
+# every registered engine should produce the same output format
+for name in diffuse.diff.get_engine_names():
+    print('%s(%s, %s) = %s' % (name, repr(a), repr(b), repr(diffuse.diff.get_engine(name)(a, b))))
+
+# a tiny budget forces the cheaper approximate fallback
+budget = diffuse.diff.Budget(max_cost=1)
+print('budget(%s, %s) = %s approximate=%s' % (repr(a), repr(b), repr(diffuse.diff.patience_diff(a, b, budget)), budget.is_approximate()))
+
+# sections sent to an executor are pickled as for a process pool, so a
+# budget with a cancel event must not be sent with them
+import concurrent.futures, pickle, threading
+
+class PicklingExecutor:
+    def submit(self, fn, *args):
+        future = concurrent.futures.Future()
+        future.set_result(fn(*pickle.loads(pickle.dumps(args))))
+        return future
+
+event = threading.Event()
+budget = diffuse.diff.Budget(cancel_event=event)
+print('executor(%s, %s) = %s' % (repr(a), repr(b), repr(diffuse.diff.patience_diff(a, b, budget, PicklingExecutor(), 0))))
+event.set()
+budget = diffuse.diff.Budget(cancel_event=event)
+print('cancelled(%s, %s) = %s approximate=%s' % (repr(a), repr(b), repr(diffuse.diff.patience_diff(a, b, budget, PicklingExecutor(), 0)), budget.is_approximate()))
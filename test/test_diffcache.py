@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os, sys, tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', os.path.join('lib', 'python3', 'dist-packages'))))
+
+import diffuse.diffcache, diffuse.filecompare
+
+runs = diffuse.diffcache.encode_runs(bytearray([ 1, 1, 0, 0, 0, 1, 0 ]))
+print(list(runs), list(diffuse.diffcache.decode_runs(runs)))
+print(list(diffuse.diffcache.encode_runs(bytearray([ 0, 0, 1 ]))), list(diffuse.diffcache.encode_runs(bytearray())))
+
+def state(fc):
+    return [ [ fc.get_string(p, i) for p in range(fc.n_panes()) ] for i in range(fc.get_n_lines()) ], list(fc._blocks)
+
+with tempfile.TemporaryDirectory() as d:
+    names = []
+    for s in 'a\nb\nc\nd\n', 'a\nc\nx\nd\ne\n', 'b\nc\nd\n':
+        name = os.path.join(d, 'f%d' % (len(names), ))
+        with open(name, 'w') as f:
+            f.write(s)
+        names.append(name)
+
+    cache_dir = os.path.join(d, 'cache')
+    results = []
+    for i in range(2):
+        fc = diffuse.filecompare.FileCompare(3)
+        fc.set_diff_cache(diffuse.diffcache.DiffCache(cache_dir))
+        fc._undo_manager.enable()
+        for p, name in enumerate(names):
+            fc._undo_manager.begin_block()
+            fc.load_file(p, name, [ 'utf-8' ])
+            fc._undo_manager.end_block()
+        results.append(state(fc))
+        print(len(os.listdir(cache_dir)))
+    # the second comparison came from the cache
+    print(results[0] == results[1])
+    print(results[1])
+    fc._undo_manager.undo()
+    print(state(fc))
+
+    # entries are evicted oldest first
+    cache = diffuse.diffcache.DiffCache(os.path.join(d, 'small'), 200)
+    for k in range(5):
+        cache.put(bytes([ k ]), [ 3 ], [ bytearray([ 0, 1, 0 ]) ])
+        os.utime(cache._get_path(bytes([ k ])), ns=(k, k))
+    cache.put(bytes([ 9 ]), [ 3 ], [ bytearray([ 0, 1, 0 ]) ])
+    print(cache.get(bytes([ 0 ])), cache.get(bytes([ 9 ])))
+
+    # the directory is only scanned when the tracked size passes the limit
+    scans = []
+    class CountingCache(diffuse.diffcache.DiffCache):
+        def evict(self):
+            scans.append(self._size)
+            diffuse.diffcache.DiffCache.evict(self)
+    cache = CountingCache(os.path.join(d, 'counted'), 1000)
+    for k in range(20):
+        cache.put(bytes([ k ]), [ 3 ], [ bytearray([ 0, 1, 0 ]) ])
+    print(len(scans), len(os.listdir(os.path.join(d, 'counted'))))
+
+    # the temporary file is removed if the entry cannot be written
+    def replace(src, dst):
+        raise OSError('replace failed')
+    replace, os.replace = os.replace, replace
+    try:
+        cache.put(bytes([ 99 ]), [ 3 ], [ bytearray([ 0, 1, 0 ]) ])
+    except OSError as e:
+        print(e)
+    os.replace = replace
+    print(sorted(os.listdir(os.path.join(d, 'counted'))) == sorted([ bytes([ k ]).hex() + '.diff' for k in range(20) if os.path.exists(cache._get_path(bytes([ k ]))) ]))
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os, sys, tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', os.path.join('lib', 'python3', 'dist-packages'))))
+
+import diffuse.dircompare
+
+def write(root, path, s, mtime):
+    name = os.path.join(root, *path.split('/'))
+    os.makedirs(os.path.dirname(name), exist_ok=True)
+    with open(name, 'w') as f:
+        f.write(s)
+    os.utime(name, ns=(mtime, mtime))
+
+with tempfile.TemporaryDirectory() as a, tempfile.TemporaryDirectory() as b:
+    for root in a, b:
+        write(root, 'same', 'same\n', 1)
+        write(root, 'touched', 'touched\n', 1 if root is a else 2)
+    write(a, 'dir/size', 'a\n', 1)
+    write(b, 'dir/size', 'a\nb\n', 1)
+    # same size and time but different contents
+    write(a, 'dir/content', 'a\n', 1)
+    write(b, 'dir/content', 'b\n', 1)
+    write(a, 'removed/x', 'x\n', 1)
+    write(b, 'dir/added', 'y\n', 1)
+    print(sorted(diffuse.dircompare.scan_tree(a).items()))
+
+    for trust_mtime in False, True:
+        dc = diffuse.dircompare.DirCompare([ a, b ], trust_mtime=trust_mtime)
+        dc.scan()
+        print([ (path, diffuse.dircompare.STATE_NAMES[state]) for path, state in dc.get_entries() ])
+
+    # files are only loaded when asked for
+    print(dc._file_compares)
+    fc = dc.get_file_compare(1)
+    print(fc.n_panes(), [ [ fc.get_string(p, i) for p in range(2) ] for i in range(fc.get_n_lines()) ])
+    print(dc.get_file_compare(1) is fc)
+    print([ [ name is None for name in dc.get_names(path) ] for path, state in dc.get_entries() ])
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os, shutil, sys, tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', os.path.join('lib', 'python3', 'dist-packages'))))
+
+import diffuse.filecompare, diffuse.lineindex, diffuse.linestore, diffuse.reader
+
+# use a tiny chunk size so lines and line endings span chunks
+diffuse.reader._CHUNK_SIZE = 3
+fd, name = tempfile.mkstemp()
+os.write(fd, 'unix\nwindows\r\nmac\rcafé\r\nlast'.encode('utf-8'))
+os.close(fd)
+stat = os.stat(name)
+
+index = diffuse.lineindex.build_index(name, 'utf-8')
+print(index)
+buffer = diffuse.lineindex.MappedBuffer(name, 'utf-8', index)
+print([ buffer.get_text(i) for i in range(len(buffer)) ])
+print(buffer.get_key(3) == diffuse.linestore.line_key('café\r\n'))
+print(list(buffer.get_keys(range(5))) == list(map(diffuse.linestore.line_key, [ buffer.get_text(i) for i in range(5) ])))
+
+cache_dir = tempfile.mkdtemp()
+print(diffuse.lineindex.load_index(cache_dir, name, stat, 'utf-8'))
+diffuse.lineindex.open_index(name, 'utf-8', stat, cache_dir)
+print(diffuse.lineindex.load_index(cache_dir, name, stat, 'utf-8'))
+print(diffuse.lineindex.load_index(cache_dir, name, stat, 'latin-1'))
+# a failed write leaves no temporary file behind
+def fail(src, dst):
+    raise OSError('replace failed')
+replace, os.replace = os.replace, fail
+try:
+    diffuse.lineindex.save_index(cache_dir, name, stat, 'latin-1', index)
+except OSError as e:
+    print(e, len(os.listdir(cache_dir)))
+os.replace = replace
+shutil.rmtree(cache_dir)
+
+# lines of a truncated file are read without touching the map
+buffer = diffuse.lineindex.MappedBuffer(name, 'utf-8', index)
+print(buffer.get_text(0))
+with open(name, 'r+b') as f:
+    f.truncate(10)
+print([ buffer.get_text(i) for i in range(1, len(buffer)) ])
+buffer.close()
+print(buffer)
+os.remove(name)
+
+# lines are compared by their keys only while a pane shows a huge file
+d = tempfile.mkdtemp()
+names = [ os.path.join(d, s) for s in ('huge', 'left', 'right') ]
+for s in names:
+    with open(s, 'w') as f:
+        f.write('a\nb\n%s\n' % (os.path.basename(s), ))
+fc = diffuse.filecompare.FileCompare(2)
+fc.enable_undos()
+fc._undo_manager.begin_block()
+fc.set_huge_file_mode(1)
+fc.load_file(0, names[0], [ 'utf-8' ])
+fc.set_huge_file_mode(1 << 30)
+fc.load_file(1, names[2], [ 'utf-8' ])
+use_keys = fc._use_keys
+fc.load_file(0, names[1], [ 'utf-8' ])
+fc._undo_manager.end_block()
+print(use_keys, fc._use_keys, [ fc.get_string(0, i) for i in range(fc.get_n_lines()) ])
+fc.close()
+shutil.rmtree(d)
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os, sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', os.path.join('lib', 'python3', 'dist-packages'))))
+
+import diffuse.linestore
+
+buffer = diffuse.linestore.TextBuffer([ 'one\n', 'two\n', 'three\n' ])
+lines = buffer.get_lines()
+lines[1]._edit = 'TWO\n'
+edited = diffuse.linestore.Line(None, 3)
+edited._edit = 'four\n'
+
+store = diffuse.linestore.LineStore([ lines[0], None, lines[1], lines[2] ])
+store[1:1] = [ None ]
+store.splice(5, 0, [ edited ])
+print(buffer)
+print(store)
+print([ store.get_string(i) for i in range(len(store)) ])
+print(store.slice(2, 4))
+
+# buffers no longer used by any store are dropped from the pool
+old = diffuse.linestore.TextBuffer([ 'old\n' ])
+store = diffuse.linestore.LineStore(old.get_lines())
+undo = store.slice(0, 1)
+for i in range(3):
+    buffer = diffuse.linestore.TextBuffer([ 'new %d\n' % (i, ) ])
+    store[0:1] = store.new_buffer_store(buffer)
+print(len(store._pool.get_buffers()), repr(store.get_string(0)), repr(undo.get_string(0)))
+del undo
+store.new_buffer_store(diffuse.linestore.TextBuffer([]))
+print(len(store._pool.get_buffers()), repr(store.get_string(0)))
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os, sys, tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', os.path.join('lib', 'python3', 'dist-packages'))))
+
+import diffuse.loader
+
+class Listener:
+    def __init__(self, loader):
+        self.events = []
+        loader.add_callback('progress', self.progress_cb, 'progress')
+        loader.add_callback('done', self.done_cb, 'done')
+
+    def progress_cb(self, src, callback_data, data):
+        self.events.append((callback_data, data[0], data[1]))
+
+    def done_cb(self, src, callback_data, data):
+        fc, error = data
+        self.events.append((callback_data, fc is not None, repr(error)))
+        if fc is not None:
+            self.events.append([ [ fc.get_string(p, i) for p in range(fc.n_panes()) ] for i in range(fc.get_n_lines()) ])
+
+names = []
+for s in 'a\nb\nc\n', 'a\nc\nd\n':
+    fd, name = tempfile.mkstemp()
+    os.write(fd, s.encode('utf-8'))
+    os.close(fd)
+    names.append(name)
+specs = [ (name, [ 'utf-8' ], None) for name in names ]
+
+loader = diffuse.loader.Loader(2, specs)
+listener = Listener(loader)
+loader.start()
+loader.join()
+print(listener.events)
+
+# missing panes are left empty
+loader = diffuse.loader.Loader(2, [ specs[0], (None, [ 'utf-8' ], None) ])
+listener = Listener(loader)
+loader.start()
+loader.join()
+print(listener.events)
+
+# cancelled loaders do not give results
+loader = diffuse.loader.Loader(2, specs)
+listener = Listener(loader)
+loader.cancel()
+loader.start()
+loader.join()
+print(loader.is_cancelled(), listener.events)
+
+# errors are reported
+loader = diffuse.loader.Loader(2, [ specs[0], ('does-not-exist', [ 'utf-8' ], None) ])
+listener = Listener(loader)
+loader.start()
+loader.join()
+print(listener.events[-1][:2], listener.events[-1][2].startswith('FileNotFoundError'))
+
+# directory trees are scanned on the worker
+roots = [ tempfile.mkdtemp() for name in names ]
+for root, name in zip(roots, names):
+    with open(name, 'rb') as f, open(os.path.join(root, 'f'), 'wb') as g:
+        g.write(f.read())
+class DirListener:
+    def __init__(self, loader):
+        self.events = []
+        loader.add_callback('done', self.done_cb)
+
+    def done_cb(self, src, callback_data, data):
+        dc, error = data
+        self.events.append((dc.get_entries(), error))
+
+loader = diffuse.loader.DirLoader(roots)
+listener = DirListener(loader)
+loader.start()
+loader.join()
+print(listener.events)
+for root in roots:
+    os.remove(os.path.join(root, 'f'))
+    os.rmdir(root)
+
+for name in names:
+    os.remove(name)
@@ -20,3 +20,21 @@ pq.insert(9, 'nine')
 while not pq.empty():
     print(pq)
     print(pq.pop())
+
+# bulk insertion, priority updates and batches
+pq = diffuse.pq.PriorityQueue()
+pq.insert_many([ (5, 'five'), (7, 'seven'), (6, 'six'), (3, 'three'), (4, 'four') ])
+pq.insert(1, 'seven')
+pq.insert_many([ (8, 'eight'), (2, 'three') ])
+print(pq.peek_many(3))
+print(pq.pop_many(4))
+print(pq.size(), pq.max_item())
+
+# lazily removed items are skipped
+pq = diffuse.pq.PriorityQueue(True)
+pq.insert_many([ (i, i) for i in range(10) ])
+pq.remove(9)
+pq.remove(4)
+pq.remove(42)
+print(pq.size(), pq.max_priority(), pq.peek_many(4))
+print(pq.pop_many(20))
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os, sys, tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', os.path.join('lib', 'python3', 'dist-packages'))))
+
+import diffuse.reader
+
+s = 'unix\nwindows\r\nmac\rcafé\r\nlast'
+print(diffuse.reader.split_lines(s))
+
+# use a tiny chunk size so lines and line endings span chunks
+diffuse.reader._CHUNK_SIZE = 3
+fd, name = tempfile.mkstemp()
+os.write(fd, s.encode('utf-8'))
+os.close(fd)
+print(list(diffuse.reader.read_lines(name, 'utf-8')))
+print(list(diffuse.reader.read_lines(name, 'utf-8', 5)))
+print(diffuse.reader.chunk_checksums(name, 0, 12, 5))
+print(diffuse.reader.chunk_checksums(name, 5, 12, 5))
+line_endings = [ 0, 0, 0 ]
+print(list(diffuse.reader.read_lines(name, 'latin-1', 0, line_endings)))
+print(line_endings)
+print(diffuse.reader.probe_encoding(name, [ 'ascii', 'utf-16', 'utf-8' ]))
+try:
+    print(list(diffuse.reader.read_lines(name, 'ascii')))
+except UnicodeDecodeError as e:
+    print('ascii failed:', e)
+os.remove(name)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os, sys, tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', os.path.join('lib', 'python3', 'dist-packages'))))
+
+import diffuse.diff, diffuse.filecompare, diffuse.linestore
+
+d = tempfile.mkdtemp()
+
+def write(name, lines):
+    name = os.path.join(d, name)
+    with open(name, 'w') as f:
+        f.write(''.join(lines))
+    return name
+
+def load(left, right):
+    fc = diffuse.filecompare.FileCompare(2)
+    fc.enable_undos()
+    fc._undo_manager.begin_block()
+    fc.load_file(0, write('left', left), [ 'utf-8' ])
+    fc.load_file(1, write('right', right), [ 'utf-8' ])
+    fc._undo_manager.end_block()
+    return fc
+
+def rows(fc):
+    return [ list(fc.get_strings(p)) for p in range(fc.n_panes()) ]
+
+# ends of the blocks as row numbers
+def cuts(fc):
+    result, n = [], 0
+    for b in fc._blocks:
+        n += b
+        result.append(n)
+    return result
+
+# replace rows [i0, i1) of pane 0 with 'lines' re-aligning only the window
+# around them, returns the window
+def replace(fc, i0, i1, lines):
+    window = fc._find_window(i0, i1)
+    fc._undo_manager.begin_block()
+    fc._replace_contents(0, i0, i1, [ diffuse.linestore.Line(s) for s in lines ])
+    fc._undo_manager.end_block()
+    return window
+
+# the lines of each pane are those of its file in order
+def check(fc, left, right):
+    assert [ [ s for s in ss if s is not None ] for ss in rows(fc) ] == [ left, right ]
+    assert sum(fc._blocks) == fc.get_n_lines()
+
+left = [ 'line %d\n' % (i, ) for i in range(200) ]
+right = left[:50] + [ 'right only\n' ] + left[50:150] + left[160:]
+
+# an edit between anchors gives the same rows as aligning the whole files
+fc = load(left, right)
+pre = rows(fc)
+i = pre[0].index('line 100\n')
+window = replace(fc, i, i + 2, [ 'edit a\n', 'edit b\n', 'edit c\n' ])
+edited = left[:100] + [ 'edit a\n', 'edit b\n', 'edit c\n' ] + left[102:]
+check(fc, edited, right)
+print(window[1] - window[0] < fc.get_n_lines(), rows(fc) == rows(load(edited, right)))
+fc._undo_manager.undo()
+print(rows(fc) == pre)
+
+# the search for anchors stops at _ANCHOR_SEARCH_LIMIT rows on each side
+limit = diffuse.filecompare._ANCHOR_SEARCH_LIMIT
+diffuse.filecompare._ANCHOR_SEARCH_LIMIT = 5
+other = [ 'other %d\n' % (i, ) for i in range(200) ]
+fc = load(left, other)
+pre = rows(fc)
+i0, i1 = fc._find_window(100, 101)
+print(i0, i1)
+replace(fc, 100, 101, [ 'edit\n' ])
+edited = [ s for s in pre[0][:100] + [ 'edit\n' ] + pre[0][101:] if s is not None ]
+check(fc, edited, other)
+print(rows(fc)[0][:i0] == pre[0][:i0], rows(fc)[1][:i0] == pre[1][:i0])
+diffuse.filecompare._ANCHOR_SEARCH_LIMIT = limit
+
+# the window never crosses a block boundary so manual alignments are kept
+fc = load(left, right)
+fc._undo_manager.begin_block()
+fc.isolate(0, 20, 30)
+fc._undo_manager.end_block()
+pre_cuts = cuts(fc)
+i = pre_cuts[0]
+window = replace(fc, i, i + 1, [ 'edit\n' ])
+print(window[0] == i, [ c for c in cuts(fc) if c <= i ] == [ c for c in pre_cuts if c <= i ])
+i = pre_cuts[1]
+window = replace(fc, i - 1, i, [ 'edit\n' ])
+print(window[1] == i, [ c for c in cuts(fc) if c < window[0] ] == [ c for c in pre_cuts if c < window[0] ])
+
+# an approximate diff makes the whole alignment approximate until the next
+# one
+calls = []
+is_approximate = diffuse.diff.Budget.is_approximate
+def approximate_once(budget):
+    calls.append(budget)
+    return len(calls) == 1 or is_approximate(budget)
+diffuse.diff.Budget.is_approximate = approximate_once
+fc = load(left, right)
+print(len(calls) > 1, fc.is_approximate())
+replace(fc, 100, 101, [ 'edit\n' ])
+print(fc.is_approximate())
+diffuse.diff.Budget.is_approximate = is_approximate
+
+for name in 'left', 'right':
+    os.remove(os.path.join(d, name))
+os.rmdir(d)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import os, sys, tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', os.path.join('lib', 'python3', 'dist-packages'))))
+
+import diffuse.filecompare, diffuse.linestore, diffuse.reader, diffuse.undo
+
+# offsets of the reads made by each reload tell which path was taken
+offsets = []
+read_lines = diffuse.reader.read_lines
+def record_read_lines(name, encoding, offset=0, line_endings=None, cancel_event=None):
+    offsets.append(offset)
+    return read_lines(name, encoding, offset, line_endings, cancel_event)
+diffuse.reader.read_lines = record_read_lines
+
+def write(name, lines):
+    with open(name, 'w', newline='') as f:
+        f.write(''.join(lines))
+
+def state(fc):
+    return [ [ fc.get_string(p, i) for p in range(fc.n_panes()) ] for i in range(fc.get_n_lines()) ], list(fc._blocks)
+
+# the lines shown in pane 'p' must be those of the file in order
+def check(fc, p, name):
+    with open(name, newline='') as f:
+        expected = f.read().splitlines(True)
+    lines = [ line for line in fc._panes[p]._contents if line is not None ]
+    assert [ line._text for line in lines ] == expected
+    assert [ line._line_number for line in lines ] == list(range(len(expected)))
+    assert sum(fc._blocks) == fc.get_n_lines()
+
+# reload pane 0 and check that undo and redo restore each state, returns
+# whether only the changed lines were reloaded and the offsets read
+def reload(fc, name):
+    pre = state(fc)
+    del offsets[:]
+    results = []
+    reload_file = fc._reload_file
+    fc._reload_file = lambda *args: results.append(reload_file(*args)) or results[-1]
+    fc._undo_manager.begin_block()
+    fc.load_file(0, name, [ 'utf-8' ], True)
+    fc._undo_manager.end_block()
+    del fc._reload_file
+    check(fc, 0, name)
+    # checksums extended after an append match those of the whole file
+    assert fc._panes[0]._chunk_crcs == diffuse.reader.chunk_checksums(name, 0, os.stat(name).st_size, diffuse.filecompare._RELOAD_CHUNK_SIZE)
+    post = state(fc)
+    fc._undo_manager.undo()
+    assert state(fc) == pre
+    fc._undo_manager.redo()
+    assert state(fc) == post
+    return results[0], offsets[0]
+
+d = tempfile.mkdtemp()
+left, right = os.path.join(d, 'left'), os.path.join(d, 'right')
+lines = [ 'line %06d\n' % (i, ) for i in range(20000) ]
+lines[-1] = lines[-1][:-1]
+write(left, lines)
+write(right, lines[:100] + [ 'extra\n' ] + lines[100:])
+
+fc = diffuse.filecompare.FileCompare(2)
+fc.enable_undos()
+fc._undo_manager.begin_block()
+fc.load_file(0, left, [ 'utf-8' ])
+fc.load_file(1, right, [ 'utf-8' ])
+fc._undo_manager.end_block()
+
+# appended lines are read from the start of the old last line as it may have
+# been extended
+lines[-1] += ' extended\n'
+lines.extend([ 'appended\n', 'no line ending' ])
+write(left, lines)
+print('append', reload(fc, left) == (True, len(''.join(lines[:19999]))))
+
+# an earlier change hidden by an append is found by re-reading the file
+lines[5] = 'LINE 000005\n'
+lines[-1] += '\n'
+lines.append('more\n')
+write(left, lines)
+print('changed prefix', reload(fc, left))
+
+# lines between the unchanged head and tail are re-aligned
+del lines[10:20]
+lines[15000:15000] = [ 'inserted\n' ] * 3
+write(left, lines)
+print('head and tail', reload(fc, left))
+
+# a replaced file is loaded in full
+temp = left + '.new'
+write(temp, lines[::-1])
+os.replace(temp, left)
+print('replaced', reload(fc, left))
+
+# the token table is kept across reloads but bounded by the lines shown
+print(0 < fc._tokenizer.size() <= diffuse.filecompare._TOKENIZER_GROWTH * 3 * fc.n_panes() * fc.get_n_lines())
+for i in range(10):
+    write(left, [ 'reload %d %d\n' % (i, j) for j in range(len(lines)) ])
+    fc._undo_manager.begin_block()
+    fc.load_file(0, left, [ 'utf-8' ], True)
+    fc._undo_manager.end_block()
+print(fc._tokenizer.size() <= diffuse.filecompare._TOKENIZER_GROWTH * 3 * fc.n_panes() * fc.get_n_lines())
+
+# the text of a buffer that only the history keeps is counted in its size
+# but the text of one still shown is not
+m = fc._undo_manager
+buffers = fc._panes[0]._contents.get_buffers()
+write(left, lines)
+m.begin_block()
+fc.load_file(0, left, [ 'utf-8' ], True)
+m.end_block()
+actions = [ a for a in m._undos[-1][0] if isinstance(a, diffuse.filecompare.File.ContentsAction) ]
+print(sum([ diffuse.undo.get_size(a) - diffuse.undo.ACTION_SIZE - 9 * (len(a._data[2]) + len(a._data[3])) for a in actions ]) == sum([ buffer.get_size() for buffer in buffers ]))
+m.begin_block()
+fc._replace_contents(0, 0, 1, [ diffuse.linestore.Line('edit\n') ])
+m.end_block()
+print(sum([ diffuse.undo.get_size(a) for a in m._undos[-1][0] if isinstance(a, diffuse.filecompare.File.ContentsAction) ]) < 1000)
+
+os.remove(left)
+os.remove(right)
+os.rmdir(d)
@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+import array, os, sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', os.path.join('lib', 'python3', 'dist-packages'))))
+
+import diffuse.rope
+
+rope = diffuse.rope.Rope(array.array('q'), array.array('q', range(2000)), True)
+snapshot = rope.copy()
+rope.splice(10, 1990, array.array('q', [ 7, 8, 9 ]))
+rope.splice(1, 2, rope.slice(10, 13))
+print(rope)
+print(len(snapshot), snapshot[1999], snapshot.total())
+print(rope.total(), rope.prefix_sum(4), rope.find(10))
+print(rope.flatten())
+
+# single item edits are merged into their neighbouring chunks
+rope = diffuse.rope.Rope(array.array('q'), array.array('q', range(1000)))
+for i in range(1000):
+    rope.splice(2 * i, 1, array.array('q', [ i, i ]))
+print(len(rope), len(list(rope.chunks())), list(rope)[:6])
@@ -24,3 +24,20 @@ s.emit('there')
 del w1
 #s.removeCallback(w1_id)
 s.emit('bob')
+
+# emissions while frozen are delivered when thawed, consecutive numbers are
+# combined
+def merge(a, b):
+    if b == a + 1:
+        return b
+    return None
+
+s = diffuse.signal.Signal(merge)
+s.add_callback(w2.callback)
+s.freeze()
+s.emit(1)
+s.emit(2)
+s.emit(3)
+s.emit(7)
+print('frozen')
+s.thaw()
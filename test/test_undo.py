@@ -25,3 +25,114 @@ m.end_block()
 m.undo()
 m.redo()
 print(m)
+
+# actions that merge when they set the same name
+class SetAction:
+    def __init__(self, name, pre, post):
+        self._data = name, pre, post
+
+    def redo(self):
+        print('set', self._data[0], self._data[2])
+
+    def undo(self):
+        print('set', self._data[0], self._data[1])
+
+    def get_size(self):
+        return 100
+
+    def merge(self, other):
+        name, pre, post = self._data
+        if other._data[0] != name:
+            return None
+        return SetAction(name, pre, other._data[2])
+
+m = diffuse.undo.UndoManager(250)
+m.enable()
+for name, pre, post in ('x', 0, 1), ('x', 1, 2), ('y', 0, 1), ('z', 0, 1), ('z', 1, 2):
+    m.begin_block(True)
+    m.apply(SetAction(name, pre, post))
+    m.end_block()
+# 'x' was dropped to fit, the two edits of 'z' merged
+print(m.get_size())
+m.undo()
+m.undo()
+m.undo()
+m.redo()
+# a block following an undo is not merged
+m.begin_block()
+m.apply(SetAction('y', 1, 2))
+m.end_block()
+print(m.get_size())
+m.set_max_size(100)
+print(m.get_size())
+
+# blocks that are not marked as mergeable stay separate undo steps, merged
+# blocks keep the order of their actions
+m = diffuse.undo.UndoManager()
+m.enable()
+for name, pre, post in ('x', 0, 1), ('x', 1, 2):
+    m.begin_block()
+    m.apply(SetAction(name, pre, post))
+    m.end_block()
+for actions in [ ('y', 0, 1), ('z', 0, 1) ], [ ('z', 1, 2), ('y', 1, 2) ]:
+    m.begin_block(True)
+    for name, pre, post in actions:
+        m.apply(SetAction(name, pre, post))
+    m.end_block()
+print(len(m._undos))
+m.undo()
+m.undo()
+
+# blocks that do not fit are written to a journal and read back
+j = diffuse.undo.Journal()
+m = diffuse.undo.UndoManager(250)
+m.enable()
+m.set_journal(j)
+for name in 'abcde':
+    m.begin_block()
+    m.apply(SetAction(name, 0, 1))
+    m.end_block()
+print(m.get_size(), len(j))
+for i in range(6):
+    m.undo()
+print(m.get_size(), len(j))
+for i in range(6):
+    m.redo()
+print(m.get_size(), len(j))
+m.clear()
+print(len(j), j.get_size())
+
+# Paged objects are written once, held weakly, and read back as one object
+# once they were dropped
+import gc, weakref
+
+class Page(diffuse.undo.Paged):
+    def __init__(self, text):
+        self._text = text
+
+j = diffuse.undo.Journal()
+page = Page('x' * 100000)
+records = [ j.write([ SetAction('a', page, None) ], 0), j.write([ SetAction('b', page, None) ], 0) ]
+ref = weakref.ref(page)
+del page
+gc.collect()
+print(ref() is None, j.get_size() < 10000)
+blocks = [ j.read(record)[0] for record in records ]
+print(blocks[0][0]._data[1] is blocks[1][0]._data[1], blocks[0][0]._data[1]._text == 'x' * 100000)
+
+# signals are frozen while a block is open
+import diffuse.signal
+
+class Listener:
+    def callback(self, sig, cb_data, data):
+        print('signal', data)
+
+listener = Listener()
+sig = diffuse.signal.Signal()
+sig.add_callback(listener.callback)
+m = diffuse.undo.UndoManager()
+m.add_signal(sig)
+m.begin_block()
+sig.emit('a')
+print('block open')
+m.end_block()